@@ -1,25 +1,63 @@
 # agent_entity_extractor.py
 
+import argparse
 import json
+import time
 import torch
 import os
+from bisect import bisect_left, bisect_right
 from pathlib import Path
 from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
 from nltk.tokenize import sent_tokenize
+from result_cache import ResultCache
+from ncit_tagger import NCItTagger, merge_entities
 
 MODEL_NAME = "d4data/biomedical-ner-all"
 PDF_CLEANED_PATH = Path("./dataset/cleaned_papers")
+NER_BACKENDS = ["torch", "quantized", "onnx"]
+NER_MODES = ["transformer", "dictionary", "merged"]   # model only, NCIt tagger only, or both
+ONNX_MODEL_DIR = Path("./models/biomedical-ner-all-onnx")
+NER_CACHE_PATH = Path("./cache/ner_cache.sqlite")
+NER_CACHE_MAX_BYTES = 512 * 1024 * 1024
+BATCH_SIZE = 16          # windows per forward pass
+WINDOW_STRIDE = 64       # tokens shared by consecutive windows
+PAPERS_PER_GROUP = 8     # papers whose sentences are batched together before writing
 
-def initialize_pipeline():
+def load_model(backend):
+    """Token-classification model for a backend: 'torch' (float32), 'quantized' (int8) or 'onnx'."""
+    if backend == "torch":
+        return AutoModelForTokenClassification.from_pretrained(MODEL_NAME)
+
+    if backend == "quantized":
+        # Dynamic int8 quantization of the Linear layers (CPU only)
+        model = AutoModelForTokenClassification.from_pretrained(MODEL_NAME)
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForTokenClassification
+        except ImportError:
+            raise ImportError("The 'onnx' backend needs optimum[onnxruntime]: pip install optimum[onnxruntime]")
+        if (ONNX_MODEL_DIR / "model.onnx").exists():
+            return ORTModelForTokenClassification.from_pretrained(ONNX_MODEL_DIR)
+        # Export once and keep the graph for later runs
+        model = ORTModelForTokenClassification.from_pretrained(MODEL_NAME, export=True)
+        model.save_pretrained(ONNX_MODEL_DIR)
+        return model
+
+    raise ValueError(f"Unknown NER backend '{backend}'. Choose from {NER_BACKENDS}")
+
+def initialize_pipeline(backend="torch"):
     """Initialize the NER pipeline"""
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForTokenClassification.from_pretrained(MODEL_NAME)
+    model = load_model(backend)
+    use_gpu = backend == "torch" and torch.cuda.is_available()
     return pipeline(
         "ner",
         model=model,
         tokenizer=tokenizer,
         aggregation_strategy="max",
-        device="cuda:0" if torch.cuda.is_available() else -1
+        device="cuda:0" if use_gpu else -1
     )
 
 def extract_text_from_cleaned_file(filename):
@@ -38,37 +76,171 @@ def process_text_chunk(nlp, text_chunk):
         print(f"⚠ Error processing chunk: {e}")
         return []
 
-def extract_entities(nlp, text):
+def sentence_spans(text):
+    """(start, end) character spans of the sentences of a text."""
     try:
         sentences = sent_tokenize(text)
     except LookupError:
         print("❌ NLTK not available. Run setup_nltk.py first.")
         return []
 
-    entities = []
-    tokenizer = nlp.tokenizer
-    
+    spans, pos = [], 0
     for sent in sentences:
-        tokens = tokenizer.tokenize(sent)
-        if len(tokens) > 400:
-            words = sent.split()
-            chunks = [' '.join(words[i:i+300]) for i in range(0, len(words), 300)]
-            for chunk in chunks:
-                entities.extend(process_text_chunk(nlp, chunk))
-        else:
-            entities.extend(process_text_chunk(nlp, sent))
+        start = text.find(sent, pos)
+        if start < 0:
+            start = pos
+        spans.append((start, start + len(sent)))
+        pos = start + len(sent)
+    return spans
+
+def build_windows(tokenizer, text, max_tokens=None, stride=WINDOW_STRIDE, spans=None):
+    """Pack consecutive sentences into windows of at most max_tokens tokens.
+
+    `spans` restricts windowing to some sentences (default: all of them); only
+    sentences with nothing but whitespace between them share a window.
+    Consecutive windows share up to `stride` tokens of trailing sentences, and a
+    sentence longer than a window is split on token boundaries with the same
+    overlap, so no entity is cut without also appearing whole in a neighbour.
+    Returns [(char_start, char_end, token_count)].
+    """
+    if max_tokens is None:
+        max_tokens = min(tokenizer.model_max_length, 512) - 2   # room for [CLS]/[SEP]
+
+    # Tokenize the whole text once and map sentences onto token ranges
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    token_starts = [start for start, _ in offsets]
+    sentences = []   # (first_token, last_token, follows the previous sentence directly)
+    prev_end = None
+    for start, end in (sentence_spans(text) if spans is None else spans):
+        first, last = bisect_left(token_starts, start), bisect_left(token_starts, end)
+        if last > first:
+            adjacent = prev_end is not None and not text[prev_end:start].strip()
+            sentences.append((first, last, adjacent))
+            prev_end = end
+
+    def span(first, last):
+        return offsets[first][0], offsets[last - 1][1], last - first
+
+    windows = []
+    i = 0
+    while i < len(sentences):
+        first, last, _ = sentences[i]
+        if last - first > max_tokens:
+            # Oversized sentence: overlapping token windows
+            step = max(max_tokens - stride, 1)
+            for tok in range(first, last, step):
+                windows.append(span(tok, min(tok + max_tokens, last)))
+                if tok + max_tokens >= last:
+                    break
+            i += 1
+            continue
+
+        j = i + 1
+        while j < len(sentences) and sentences[j][2] and sentences[j][1] - sentences[i][0] <= max_tokens:
+            j += 1
+        windows.append(span(sentences[i][0], sentences[j - 1][1]))
+        if j >= len(sentences):
+            break
+        if not sentences[j][2] or sentences[j][1] - sentences[j][0] > max_tokens:
+            i = j
+            continue
+
+        # Start the next window with trailing sentences worth at most `stride` tokens
+        k = j
+        while k - 1 > i and sentences[j - 1][1] - sentences[k - 1][0] <= stride:
+            k -= 1
+        i = k
+
+    return windows
+
+def run_batched(nlp, units, batch_size=BATCH_SIZE):
+    """Run the NER pipeline over [(window_text, token_count)] in length-sorted batches.
+
+    Sorting by token count keeps padding inside each batch small; results are
+    returned in the original unit order.
+    """
+    order = sorted(range(len(units)), key=lambda i: units[i][1])
+    texts = [units[i][0] for i in order]
+    try:
+        outputs = nlp(texts, batch_size=batch_size) if texts else []
+    except Exception as e:
+        print(f"⚠ Batched inference failed ({e}); retrying sentence by sentence")
+        outputs = [process_text_chunk(nlp, t) for t in texts]
+
+    results = [None] * len(units)
+    for i, output in zip(order, outputs):
+        results[i] = output
+    return results
+
+def merge_window_entities(text, windows, outputs):
+    """Map window-relative predictions back to the text and drop duplicates.
+
+    A prediction made further from its window's edges wins over an overlapping
+    one, so an entity truncated at one window boundary yields to its complete
+    copy in the neighbouring window.
+    """
+    candidates = []
+    for (win_start, win_end, _), entities in zip(windows, outputs):
+        for ent in entities:
+            start, end = win_start + ent["start"], win_start + ent["end"]
+            margin = min(start - win_start, win_end - end)
+            candidates.append((margin, float(ent["score"]), start, end, ent["entity_group"]))
+
+    accepted = []   # sorted, non-overlapping (start, end, label, score)
+    for margin, score, start, end, label in sorted(candidates, key=lambda c: (-c[0], -c[1])):
+        pos = bisect_left(accepted, (start,))
+        if pos > 0 and accepted[pos - 1][1] > start:
+            continue
+        if pos < len(accepted) and accepted[pos][0] < end:
+            continue
+        accepted.insert(pos, (start, end, label, score))
 
     return [
-        {"label": ent["entity_group"], "text": ent["word"], "score": float(ent["score"])}
-        for ent in entities if ent["score"] >= 0.7
+        {"start": start, "end": end, "label": label, "text": text[start:end], "score": score}
+        for start, end, label, score in accepted
     ]
 
-def extract_entities_from_file(filename: str, output_folder: Path):
-    """Process a cleaned .txt file and save extracted entities to a folder"""
-    nlp = initialize_pipeline()
-    text = extract_text_from_cleaned_file(filename)
-    entities = extract_entities(nlp, text)
+def cache_by_sentence(entities, computed_spans, all_spans, all_keys):
+    """{sentence_key: [entities relative to the sentence]} for freshly computed sentences.
+
+    Entities crossing a sentence boundary are not cached.
+    """
+    computed = set(computed_spans)
+    starts = [start for start, _ in all_spans]
+    owners = {}   # a sentence repeated in the text is cached from its first occurrence
+    for i, (span, key) in enumerate(zip(all_spans, all_keys)):
+        if span in computed:
+            owners.setdefault(key, i)
+    entries = {key: [] for key in owners}
+    for ent in entities:
+        i = bisect_right(starts, ent["start"]) - 1
+        if i < 0 or owners.get(all_keys[i]) != i:
+            continue
+        start, end = all_spans[i]
+        if ent["end"] <= end:
+            entries[all_keys[i]].append({
+                "start": ent["start"] - start, "end": ent["end"] - start,
+                "label": ent["label"], "score": ent["score"]
+            })
+    return entries
 
+def format_entities(entities):
+    formatted = []
+    for ent in entities:
+        if ent["score"] < 0.7:
+            continue
+        entry = {"label": ent["label"], "text": ent["text"], "score": ent["score"], "start": ent["start"], "end": ent["end"]}
+        if "concept_ids" in ent:
+            entry["concept_ids"] = ent["concept_ids"]
+        formatted.append(entry)
+    return formatted
+
+def extract_entities(nlp, text, batch_size=BATCH_SIZE):
+    windows = build_windows(nlp.tokenizer, text)
+    units = [(text[start:end], n_tokens) for start, end, n_tokens in windows]
+    return format_entities(merge_window_entities(text, windows, run_batched(nlp, units, batch_size)))
+
+def save_entities(entities, output_folder: Path):
     output_folder.mkdir(parents=True, exist_ok=True)
     output_path = output_folder / "extracted_entities.json"
 
@@ -78,5 +250,164 @@ def extract_entities_from_file(filename: str, output_folder: Path):
     print(f"✅ Extracted {len(entities)} entities to {output_path}")
 
 
+class EntityExtractor:
+    """Long-lived NER extractor: loads the model once and batches windows across papers.
+
+    mode 'dictionary' tags NCIt labels/synonyms only (no model is loaded), 'merged'
+    adds those matches to the model's entities and gives exact-span hits their concept IDs.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, papers_per_group=PAPERS_PER_GROUP,
+                 max_tokens=None, stride=WINDOW_STRIDE, backend="torch", cache_path=NER_CACHE_PATH,
+                 mode="transformer", tagger=None):
+        if mode not in NER_MODES:
+            raise ValueError(f"Unknown NER mode '{mode}'. Choose from {NER_MODES}")
+        self.mode = mode
+        self.backend = backend
+        self.batch_size = batch_size
+        self.papers_per_group = papers_per_group
+        self.max_tokens = max_tokens
+        self.stride = stride
+        self.tagger = tagger or (NCItTagger() if mode != "transformer" else None)
+
+        self.nlp = self.cache = None
+        if mode != "dictionary":
+            self.nlp = initialize_pipeline(backend)
+            # Per-sentence results, keyed by model name, revision and backend
+            self.cache = ResultCache(cache_path, max_bytes=NER_CACHE_MAX_BYTES) if cache_path else None
+            revision = getattr(self.nlp.model.config, "_commit_hash", None) or "unknown"
+            self.model_key = f"{MODEL_NAME}@{revision}/{backend}"
+
+    def extract_many(self, texts):
+        """Entities for each text, according to the extractor's mode."""
+        if self.mode == "dictionary":
+            return [self.tagger.tag(text) for text in texts]
+        results = self.run_model(texts)
+        if self.mode == "merged":
+            results = [merge_entities(entities, self.tagger.tag(text)) for text, entities in zip(texts, results)]
+        return results
+
+    def run_model(self, texts):
+        """Model entities for each text, with all their windows batched together by length.
+
+        Sentences already in the cache are not re-run; only the runs of uncached
+        sentences are windowed, and their results are cached sentence by sentence.
+        """
+        spans = [sentence_spans(text) for text in texts]
+        keys = [[ResultCache.make_key(self.model_key, text[a:b]) for a, b in text_spans]
+                for text, text_spans in zip(texts, spans)]
+        cached = self.cache.get_many(k for text_keys in keys for k in text_keys) if self.cache else {}
+
+        misses = [[span for span, key in zip(text_spans, text_keys) if key not in cached]
+                  for text_spans, text_keys in zip(spans, keys)]
+        windows = [build_windows(self.nlp.tokenizer, text, self.max_tokens, self.stride, spans=text_misses)
+                   if text_misses else []
+                   for text, text_misses in zip(texts, misses)]
+        units = [(text[start:end], n_tokens) for text, text_windows in zip(texts, windows)
+                 for start, end, n_tokens in text_windows]
+        outputs = run_batched(self.nlp, units, self.batch_size)
+
+        results, pos, new_entries = [], 0, {}
+        for text, text_spans, text_keys, text_misses, text_windows in zip(texts, spans, keys, misses, windows):
+            text_outputs = outputs[pos:pos + len(text_windows)]
+            pos += len(text_windows)
+            fresh = merge_window_entities(text, text_windows, text_outputs)
+            new_entries.update(cache_by_sentence(fresh, text_misses, text_spans, text_keys))
+
+            entities = fresh + [
+                {"start": start + e["start"], "end": start + e["end"], "label": e["label"],
+                 "text": text[start + e["start"]:start + e["end"]], "score": e["score"]}
+                for (start, _), key in zip(text_spans, text_keys) if key in cached
+                for e in cached[key]
+            ]
+            results.append(format_entities(sorted(entities, key=lambda e: e["start"])))
+
+        if self.cache and new_entries:
+            self.cache.put_many(new_entries)
+        return results
+
+    def extract(self, text):
+        return self.extract_many([text])[0]
+
+    def extract_corpus(self, filenames, output_root: Path):
+        """Extract entities for cleaned .txt files, writing <output_root>/<paper>/extracted_entities.json.
+
+        Papers are processed in groups so results are written as each group finishes.
+        """
+        filenames = list(filenames)
+        for start in range(0, len(filenames), self.papers_per_group):
+            group = filenames[start:start + self.papers_per_group]
+            texts = [extract_text_from_cleaned_file(name) for name in group]
+            for name, entities in zip(group, self.extract_many(texts)):
+                save_entities(entities, output_root / Path(name).stem)
+
+        if self.cache:
+            stats = self.cache.stats()
+            print(f"🗃 NER cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%})")
+
+def extract_entities_from_file(filename: str, output_folder: Path, extractor=None):
+    """Process a cleaned .txt file and save extracted entities to a folder"""
+    extractor = extractor or EntityExtractor()
+    text = extract_text_from_cleaned_file(filename)
+    save_entities(extractor.extract(text), output_folder)
+
+
+def compare_backends(candidate="quantized", reference="torch", folder=PDF_CLEANED_PATH, limit=None):
+    """Accuracy parity and throughput of a candidate NER backend against the float model.
+
+    Entities are matched on (start, end, label) over the cleaned papers; reports
+    precision/recall/F1 of the candidate w.r.t. the reference, the mean score
+    delta on matched entities, and the speed-up.
+    """
+    files = sorted(Path(folder).glob("*.txt"))[:limit]
+    texts = [f.read_text(encoding="utf-8") for f in files]
+    if not texts:
+        print(f"❌ No cleaned papers in {folder}. Run the PDF cleaning step first.")
+        return None
+
+    runs = {}
+    for backend in (reference, candidate):
+        extractor = EntityExtractor(backend=backend, cache_path=None)
+        start = time.perf_counter()
+        entities = extractor.extract_many(texts)
+        runs[backend] = (entities, time.perf_counter() - start)
+        print(f"⏱ {backend}: {runs[backend][1]:.1f}s for {len(texts)} papers")
+
+    matched = ref_total = cand_total = 0
+    score_deltas = []
+    for ref_entities, cand_entities in zip(runs[reference][0], runs[candidate][0]):
+        ref = {(e["start"], e["end"], e["label"]): e["score"] for e in ref_entities}
+        cand = {(e["start"], e["end"], e["label"]): e["score"] for e in cand_entities}
+        common = ref.keys() & cand.keys()
+        matched += len(common)
+        ref_total += len(ref)
+        cand_total += len(cand)
+        score_deltas.extend(abs(ref[k] - cand[k]) for k in common)
+
+    precision = matched / cand_total if cand_total else 1.0
+    recall = matched / ref_total if ref_total else 1.0
+    report = {
+        "reference": reference,
+        "candidate": candidate,
+        "papers": len(texts),
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        "mean_score_delta": round(sum(score_deltas) / len(score_deltas), 4) if score_deltas else 0.0,
+        "speedup": round(runs[reference][1] / runs[candidate][1], 2) if runs[candidate][1] else None,
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
 if __name__ == "__main__":
-    print("❌ This script should be used via main_pipeline.py")
+    parser = argparse.ArgumentParser(description="Biomedical NER (normally run via main_pipeline.py)")
+    parser.add_argument("--parity", choices=[b for b in NER_BACKENDS if b != "torch"],
+                        help="compare a CPU backend against the float32 model on the cleaned papers")
+    parser.add_argument("--limit", type=int, default=None, help="number of papers to compare")
+    args = parser.parse_args()
+
+    if args.parity:
+        compare_backends(candidate=args.parity, limit=args.limit)
+    else:
+        print("❌ This script should be used via main_pipeline.py")
@@ -3,16 +3,15 @@ import json
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 from typing import List, Dict, Optional
-from langchain_ollama import OllamaLLM
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
+import llm_provider
+from llm_provider import get_llm
 
 # Load environment variables
 load_dotenv()
 NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-OPENAI_API_KEY = os.getenv("API_KEY")
 
 class EnhancedNeo4jGraph:
     def __init__(self, uri: str, user: str, password: str):
@@ -37,18 +36,12 @@ class QAModel:
         self.llm = self._initialize_model()
         
     def _initialize_model(self):
-        if self.model_type == "openai":
-            return ChatOpenAI(
-                model_name="gpt-4o",
-                api_key=OPENAI_API_KEY
-            )
-        else:  # Default to Ollama
-            return OllamaLLM(
-                model="llama3.3:latest"
-            )
+        # Shared client: gpt-4o for 'openai', llama3.3 (Ollama) otherwise
+        return get_llm(self.model_type)
     
     def invoke(self, prompt):
-        return self.llm.invoke(prompt)
+        # Through the provider, so token usage (cached prompt tokens) is recorded
+        return llm_provider.invoke(prompt, self.model_type)
 
 def initialize_services(model_choice: str):
     """Initialize both Neo4j and LLM services"""
@@ -122,14 +115,13 @@ def format_entity_info(entity: Dict) -> str:
     
     return info
 
+# Static instructions first, per-question data last, so the prefix can be served
+# from the provider's prompt cache / Ollama's KV cache across questions
 qa_prompt = PromptTemplate.from_template("""
-You are a precise biomedical knowledge graph assistant. Only use the provided relationships.
-
-Available Relationships:
-{graph_data}
+You are a precise biomedical knowledge graph assistant. Only use the relationships provided below.
 
 Guidelines:
-1. Only answer using the relationships shown above
+1. Only answer using the Available Relationships listed below
 2. If information isn't available, say: "This information is not in the knowledge graph."
 3. For entities:
    - Always include NCIT IDs if available
@@ -140,10 +132,13 @@ Guidelines:
 5. Never invent information
 6. If it is a general question please dont include paper sources.
 
-Question: {question}
-
 Answer in this format:
 <answer> [NCIT IDs if available] [source: papers if available]
+
+Available Relationships:
+{graph_data}
+
+Question: {question}
 """)
 
 def answer_question(question: str, qa_model: QAModel) -> str:
@@ -298,6 +293,8 @@ def main_loop(model_choice: str = None):
         finally:
             graph.close()
 
+    llm_provider.usage.report()
+
 if __name__ == "__main__":
     graph = None
     qa_model = None
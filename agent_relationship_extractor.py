@@ -1,10 +1,16 @@
 import json
-import re
 import os
+import asyncio
+import time
 from dotenv import load_dotenv
 from pathlib import Path
 from langchain_core.prompts import PromptTemplate
-import tiktoken
+from result_cache import ResultCache
+from llm_dispatch import dispatcher_for
+import llm_provider
+from llm_provider import get_encoding
+from llm_json import JSONObjectStream, salvage_json, repair_prompt, repair_budget
+from prompt_budget import plan_prompt, format_report, count_tokens
 
 # === CONFIGURATION ===
 #SPECIFIC_FILE = "s00262-020-02736-z.txt"
@@ -21,8 +27,38 @@ import tiktoken
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("API_KEY")
 
-relationship_extraction_prompt = PromptTemplate.from_template("""
-Analyze this biomedical text and extract precise relationships between entities with scientific rigor.
+# === LLM RESPONSE CACHE ===
+# 'on': reuse responses for identical prompts/models, 'off': always call the model,
+# 'offline': never call the model; a cache miss is an error (replays and tests)
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "on")
+LLM_CACHE_PATH = Path("./cache/llm_cache.sqlite")
+LLM_CACHE_TTL = 30 * 24 * 3600          # seconds
+LLM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Read responses as they stream in, acting on each relationship as soon as it closes
+LLM_STREAM = os.getenv("LLM_STREAM", "off") == "on"
+
+LLM_MODELS = {
+    "openai": ("gpt-4o", {"temperature": 0}),
+    "ollama": ("llama3.3:latest", {"stop": ["<Think>", "</Think>", "<|im_end|>"]}),
+}
+
+# === EXTRACTION MODE ===
+# 'single': one request fitted to PROMPT_TOKEN_BUDGET (prompt_budget.py); 'chunked': map-reduce over the whole paper
+EXTRACTION_MODE = os.getenv("RELATION_EXTRACTION_MODE", "single")
+CHUNK_TOKENS = 3000      # text tokens per section
+EXPECTED_COMPLETION_TOKENS = 1000   # budgeted per request for the tokens-per-minute limit
+
+_llm_cache = None
+
+class LLMCacheMiss(RuntimeError):
+    """Raised in offline mode when a prompt has no cached response."""
+
+# The instructions and example come first and never change, so Ollama's KV cache can
+# reuse them across papers; everything that varies per call is appended at the end.
+# (At ~500 tokens the prefix is below OpenAI's 1024-token prompt-caching minimum.)
+RELATIONSHIP_PROMPT_PREFIX = """
+Analyze the biomedical text given at the end and extract precise relationships between entities with scientific rigor.
 The text may contain technical terminology and entity names with minor variations — use contextual understanding to match them.
 
 Return ONLY a valid JSON array following this exact schema:
@@ -32,10 +68,6 @@ Return ONLY a valid JSON array following this exact schema:
   "target": "EntityName (normalized form)",
 }}]
 
-Text: {text}
-Entities: {entities}
-Core Topic Entity: {core_entity}
-
 Focus on these biomedical relationship types (ordered by priority):
 1. Molecular interactions: binds_to, inhibits, activates, phosphorylates, regulates_expression_of  
 2. Pharmacological: treats, contraindicates, metabolizes, potentiates, side_effect_of  
@@ -49,9 +81,9 @@ Extraction rules:
 - For ambiguous cases, prefer more specific relationship types
 - Split compound entities into separate relationships
 - Try to extract meaningful relationships for as many entities as possible, but never extract unsupported relationships
-- Ensure at least one extracted relationship involves the core topic entity: "{core_entity}"
-- However, avoid making all relationships about "{core_entity}" unless the text explicitly supports that.
-- Include diverse and relevant biomedical relationships, even if they do not directly reference "{core_entity}"
+- Ensure at least one extracted relationship involves the Core Topic Entity given below
+- However, avoid making all relationships about the Core Topic Entity unless the text explicitly supports that.
+- Include diverse and relevant biomedical relationships, even if they do not directly reference the Core Topic Entity
 
 IMPORTANT: You MUST return ONLY a valid JSON array following the exact schema above.
 Do not include any additional text, explanations, or markdown formatting.
@@ -70,105 +102,257 @@ Example Output:
     "target": "breast cancer"
   }}
 ]
+"""
+
+RELATIONSHIP_PROMPT_SUFFIX = """
+Core Topic Entity: {core_entity}
+Entities: {entities}
+Text: {text}
 
 Output ONLY the JSON array with no additional commentary:
-""")
+"""
+
+RELATIONSHIP_SCHEMA = '[{"source": "...", "relation": "...", "target": "..."}]'
+
+relationship_extraction_prompt = PromptTemplate.from_template(RELATIONSHIP_PROMPT_PREFIX + RELATIONSHIP_PROMPT_SUFFIX)
 
 
 #relationship_chain = relationship_extraction_prompt | llm
 
-def trim_to_token_limit(text, max_tokens=22000, model_name="gpt-4o"):
-    enc = tiktoken.encoding_for_model(model_name)
-    tokens = enc.encode(text)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
-    return enc.decode(tokens)
+def get_llm_cache():
+    """The shared response cache, or None when caching is off."""
+    global _llm_cache
+    if LLM_CACHE_MODE == "off":
+        return None
+    if _llm_cache is None:
+        _llm_cache = ResultCache(LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL)
+    return _llm_cache
+
+def llm_cache_stats():
+    return _llm_cache.stats() if _llm_cache else None
+
+def call_model(prompt, backend="ollama", on_relationship=None):
+    """Send a rendered prompt to the model and return the response text (blocking).
+
+    With LLM_STREAM on, the response is read as it is generated and each
+    relationship object is passed to on_relationship as soon as it closes.
+    """
+    model_name, params = LLM_MODELS[backend]
+    if not LLM_STREAM:
+        return llm_provider.invoke(prompt, backend, model_name, **params)
+
+    parser, pieces = JSONObjectStream(), []
+    for piece in llm_provider.stream(prompt, backend, model_name, **params):
+        pieces.append(piece)
+        for obj in parser.feed(piece):
+            if on_relationship and is_relationship(obj):
+                on_relationship(obj)
+    return "".join(pieces)
+
+def estimate_tokens(prompt):
+    """Prompt tokens plus the expected completion, for the tokens-per-minute budget."""
+    return len(get_encoding().encode(prompt, disallowed_special=())) + EXPECTED_COMPLETION_TOKENS
 
-def extract_relationships(text, entities, core_entity, backend="ollama"):
+async def invoke_llm_async(prompt, backend, dispatcher, on_relationship=None):
+    """Response text for a rendered prompt, served from the cache when possible.
+
+    Only responses that yield at least one relationship are cached, so a bad
+    response is asked for again on the next run instead of being replayed.
+    """
+    backend = "openai" if backend == "openai" else "ollama"
+    model_name, params = LLM_MODELS[backend]
+    cache = get_llm_cache()
+    key = ResultCache.make_key(backend, model_name, params, prompt)
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    if LLM_CACHE_MODE == "offline":
+        raise LLMCacheMiss(f"No cached {model_name} response for this prompt (LLM_CACHE_MODE=offline)")
+
+    response_content = await dispatcher.call(call_model, prompt, backend, on_relationship,
+                                             tokens=estimate_tokens(prompt))
+    if cache and parse_relationships(response_content)[0]:
+        cache.put(key, response_content)
+    return response_content
+
+def is_relationship(obj):
+    return isinstance(obj, dict) and all(isinstance(obj.get(key), str) for key in ["source", "relation", "target"])
+
+def parse_relationships(response_content):
+    """Validated [{source, relation, target}] from a raw LLM response, and the
+    fragments that could not be recovered (see llm_json.salvage_json)."""
+    objects, fragments = salvage_json(response_content)
+    valid_relationships = []
+    for rel in objects:
+        if is_relationship(rel):
+            valid_relationships.append({
+                "source": rel["source"].strip(),
+                "relation": rel["relation"].strip(),
+                "target": rel["target"].strip()
+            })
+    return valid_relationships, fragments
+
+async def repair_relationships(fragments, backend, dispatcher):
+    """Relationships from one short repair request over the unrecovered fragments, within the repair budget."""
+    prompt = repair_prompt(fragments, RELATIONSHIP_SCHEMA)
+    if prompt is None or not repair_budget.take():
+        return []
     try:
-        # Dynamically choose backend
-        if backend == "openai":
-            from langchain_openai import ChatOpenAI
-            llm = ChatOpenAI(model="gpt-4o", temperature=0)
-        else:
-            from langchain_ollama import OllamaLLM
-            llm = OllamaLLM(model="llama3.3:latest", stop=["<Think>", "</Think>", "<|im_end|>"])
-
-        chain = relationship_extraction_prompt | llm
-
-        response = chain.invoke({
-            "text": trim_to_token_limit(text),
-            "entities": json.dumps(entities),
-            "core_entity": core_entity
-        })
-
-        # Get the content from the response object
-        response_content = response.content if hasattr(response, "content") else str(response)
-        
-        # Print raw response for debugging
-        print("\n=== RAW RESPONSE ===")
-        print(response_content)
-        print("===================\n")
-        
-        # Clean the response - remove markdown code blocks if present
-        cleaned_response = re.sub(r'```json|```', '', response_content).strip()
-        
-        # Fix common JSON issues before parsing
-        def fix_json(json_str):
-            # Remove trailing commas
-            json_str = re.sub(r',\s*([}\]])', r'\1', json_str)
-            # Remove comments
-            json_str = re.sub(r'/\*.*?\*/', '', json_str, flags=re.DOTALL)
-            json_str = re.sub(r'//.*$', '', json_str, flags=re.MULTILINE)
-            return json_str
-
-        fixed_response = fix_json(cleaned_response)
-        
-        # Parse the JSON response
-        relationships = None
-        try:
-            relationships = json.loads(fixed_response)
-        except json.JSONDecodeError:
-            json_match = re.search(r'(\[.*\]|\{.*\})', fixed_response, re.DOTALL)
-            if json_match:
-                try:
-                    relationships = json.loads(fix_json(json_match.group(1)))
-                except json.JSONDecodeError as e:
-                    raise ValueError(f"Failed to parse JSON: {str(e)}")
-
-        if relationships is None:
-            raise ValueError("No valid JSON found in response")
-
-        # Normalize to list format
-        if isinstance(relationships, dict):
-            relationships = [relationships]
-        elif not isinstance(relationships, list):
-            raise ValueError("Response is not a JSON array or object")
-
-        # Validate and clean relationships
-        valid_relationships = []
-        for rel in relationships:
-            if isinstance(rel, dict) and all(key in rel for key in ["source", "relation", "target"]):
-                valid_relationships.append({
-                    "source": rel["source"].strip(),
-                    "relation": rel["relation"].strip(),
-                    "target": rel["target"].strip()
-                })
+        repaired, _ = parse_relationships(await invoke_llm_async(prompt, backend, dispatcher))
+    except Exception as e:
+        print(f"❌ Error repairing relationship output: {str(e)}")
+        return []
+    print(f"🩹 Repaired {len(fragments)} malformed fragment(s) into {len(repaired)} relationships")
+    return repaired
 
-        # Print final output
-        print("\n=== EXTRACTED RELATIONSHIPS ===")
-        print(json.dumps(valid_relationships, indent=2))
-        print("==============================\n")
-        
-        return valid_relationships
+def build_prompts(text, entities, core_entity, mode=None, entity_scores=None):
+    """One prompt with the best-ranked entities and the text sections that mention
+    them, within the token budget ('single'), or one per token-bounded section
+    carrying only the entities that section mentions ('chunked').
+
+    entity_scores: {entity (lowercase): NER score}, from load_entity_scores().
+    """
+    if (mode or EXTRACTION_MODE) != "chunked":
+        overhead = count_tokens(relationship_extraction_prompt.format(text="", entities="", core_entity=core_entity))
+        selected_text, selected_entities, report = plan_prompt(text, entities, core_entity, entity_scores,
+                                                               overhead=overhead)
+        print(format_report(report))
+        return [relationship_extraction_prompt.format(
+            text=selected_text,
+            entities=json.dumps(selected_entities),
+            core_entity=core_entity
+        )]
+
+    prompts = []
+    for chunk in split_into_chunks(text):
+        chunk_entities = entities_in_text(entities, chunk)
+        if chunk_entities:   # a section without known entities has nothing to relate
+            prompts.append(relationship_extraction_prompt.format(
+                text=chunk,
+                entities=json.dumps(chunk_entities),
+                core_entity=core_entity
+            ))
+    return prompts
 
+async def extract_relationships_async(text, entities, core_entity, backend, dispatcher, mode=None, verbose=False,
+                                      on_relationship=None, entity_scores=None):
+    """Relationships in a paper; the prompts (one, or one per section) run concurrently
+    through the dispatcher and their triples are merged and deduplicated."""
+    try:
+        prompts = build_prompts(text, entities, core_entity, mode, entity_scores)
     except Exception as e:
         print(f"❌ Error in relationship extraction: {str(e)}")
-        if 'response_content' in locals():
-            print(f"Raw response was: {response_content[:1000]}")
+        return []
+    if not prompts:
+        print("⚠ No entities found in the text; nothing to extract")
         return []
 
-    
+    responses = await asyncio.gather(*(invoke_llm_async(p, backend, dispatcher, on_relationship) for p in prompts),
+                                     return_exceptions=True)
+    relationships = []
+    for response_content in responses:
+        if isinstance(response_content, Exception):
+            print(f"❌ Error in relationship extraction: {str(response_content)}")
+            continue
+        if verbose:
+            # Print raw response for debugging
+            print("\n=== RAW RESPONSE ===")
+            print(response_content)
+            print("===================\n")
+        parsed, fragments = parse_relationships(response_content)
+        relationships.extend(parsed)
+        if fragments:
+            if parsed:
+                print(f"⚠ Salvaged {len(parsed)} relationships from a malformed response")
+            else:
+                print(f"❌ No valid JSON in response: {response_content[:1000]}")
+            # Only the unparsed part is sent back, never the paper
+            relationships.extend(await repair_relationships(fragments, backend, dispatcher))
+
+    merged = dedupe_relationships(relationships)
+    if len(prompts) > 1:
+        print(f"🧩 {len(prompts)} sections -> {len(relationships)} relationships, {len(merged)} after dedupe")
+    if verbose:
+        # Print final output
+        print("\n=== EXTRACTED RELATIONSHIPS ===")
+        print(json.dumps(merged, indent=2))
+        print("==============================\n")
+    return merged
+
+def extract_relationships(text, entities, core_entity, backend="ollama", mode=None, entity_scores=None):
+    """Relationships in one paper: one request within the prompt token budget ('single') or
+    concurrent requests over token-bounded sections of the whole text ('chunked')."""
+    dispatcher = dispatcher_for(backend)
+    started = time.perf_counter()
+
+    def show(rel):
+        # Streaming: print each triple as soon as the model has closed it
+        print(f"🔹 [{time.perf_counter() - started:.1f}s] {rel['source']} --{rel['relation']}--> {rel['target']}")
+
+    return asyncio.run(extract_relationships_async(text, entities, core_entity, backend, dispatcher, mode,
+                                                   verbose=True, on_relationship=show, entity_scores=entity_scores))
+
+async def extract_relationships_corpus(papers, core_entity, backend="ollama", on_result=None, mode=None):
+    """Extract relationships for many papers at once, [(name, text, entities[, entity_scores])].
+
+    All papers' requests share one dispatcher, so throughput is bounded by the
+    backend's rate limits or concurrency cap rather than by per-request latency.
+    on_result(name, relationships) is called as each paper finishes.
+    """
+    dispatcher = dispatcher_for(backend)
+
+    async def run(name, text, entities, entity_scores=None):
+        relationships = await extract_relationships_async(text, entities, core_entity, backend, dispatcher, mode,
+                                                          entity_scores=entity_scores)
+        if on_result:
+            on_result(name, relationships)
+        return name, relationships
+
+    results = dict(await asyncio.gather(*(run(*paper) for paper in papers)))
+    print(f"📨 {dispatcher.calls} LLM calls for {len(papers)} papers ({dispatcher.retries} retries, "
+          f"{repair_budget.used} repairs, {repair_budget.denied} over the repair budget)")
+    return results
+
+def split_into_chunks(text, max_tokens=CHUNK_TOKENS, model_name="gpt-4o"):
+    """Split text at line boundaries into sections of at most max_tokens tokens.
+
+    A single line longer than that is cut at token boundaries.
+    """
+    enc = get_encoding(model_name)
+    chunks, current, current_tokens = [], [], 0
+    for line in text.splitlines(keepends=True):
+        tokens = enc.encode(line, disallowed_special=())
+        if len(tokens) > max_tokens:
+            pieces = [enc.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+        else:
+            pieces = [line]
+        for piece in pieces:
+            n = len(tokens) if len(pieces) == 1 else len(enc.encode(piece, disallowed_special=()))
+            if current and current_tokens + n > max_tokens:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += n
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def entities_in_text(entities, text):
+    """Entities (strings) that occur in text, case-insensitively."""
+    lowered = text.lower()
+    return [entity for entity in entities if entity.lower() in lowered]
+
+def dedupe_relationships(relationships):
+    """Drop repeated triples (case-insensitive), keeping first occurrences in order."""
+    seen, unique = set(), []
+    for rel in relationships:
+        key = (rel["source"].lower(), rel["relation"].lower(), rel["target"].lower())
+        if key not in seen:
+            seen.add(key)
+            unique.append(rel)
+    return unique
+
 def read_text_file(file_path):
     """Read content from a text file."""
     try:
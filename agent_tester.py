@@ -4,6 +4,9 @@ from pathlib import Path
 from nltk.tokenize import sent_tokenize
 from dotenv import load_dotenv
 import os 
+from llm_provider import get_llm, response_text
+from llm_json import salvage_json, repair_prompt, repair_budget
+from sentence_index import SentenceIndex
 # Optional: select your model backend
 USE_OPENAI = False  # Set to True to use OpenAI GPT-4o
 
@@ -11,11 +14,9 @@ load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("API_KEY")
 
 if USE_OPENAI:
-    from langchain_openai import ChatOpenAI
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    llm = get_llm("openai", "gpt-4o", temperature=0)
 else:
-    from langchain_ollama import OllamaLLM
-    llm = OllamaLLM(model="", temperature=0, stop=["<|im_end|>"])
+    llm = get_llm("ollama", "", temperature=0, stop=["<|im_end|>"])
 
 # Prompt template
 prompt_template = """
@@ -42,6 +43,25 @@ Respond only in this exact JSON format:
 }}
 """
 
+VALIDATION_SCHEMA = '{"source_present": true, "target_present": true, "relationship_valid": false, "reason": "..."}'
+VALIDATION_KEYS = ("source_present", "target_present", "relationship_valid")
+
+def parse_validation(content):
+    """The verdict object in a response, or None, and the fragments that could not be parsed."""
+    objects, fragments = salvage_json(content)
+    for obj in objects:
+        if isinstance(obj, dict) and all(key in obj for key in VALIDATION_KEYS):
+            return obj, fragments
+    return None, fragments
+
+def repair_validation(fragments):
+    """One short repair request over the unparsed output, within the shared repair budget."""
+    prompt = repair_prompt(fragments, VALIDATION_SCHEMA)
+    if prompt is None or not repair_budget.take():
+        return None
+    data, _ = parse_validation(response_text(llm.invoke(prompt)))
+    return data
+
 # Load helpers
 def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
@@ -57,10 +77,25 @@ def normalize(text):
     text = text.replace("‑", "-").replace("–", "-").replace("−", "-")
     return text.strip()
 
-def filter_context(text, keywords, max_chars=12000):
-    sentences = sent_tokenize(text)
-    filtered = [s for s in sentences if any(k in s.lower() for k in keywords)]
-    return " ".join(filtered)[:max_chars]
+MAX_CONTEXT_CHARS = 12000
+
+def build_sentence_index(text, relationships):
+    """Split the paper into sentences once and index them by every source/target in its relationships."""
+    keywords = set()
+    for rel in relationships:
+        keywords.update((rel.get("source", "").lower(), rel.get("target", "").lower()))
+    return SentenceIndex(sent_tokenize(text), keywords)
+
+def absent_verdict(source_present, target_present):
+    """Verdict for a claim whose entity does not occur in the paper; no LLM call needed."""
+    missing = [name for name, present in (("source", source_present), ("target", target_present)) if not present]
+    return {
+        "source_present": source_present,
+        "target_present": target_present,
+        "relationship_valid": False,
+        "reason": f"The {' and '.join(missing)} entity does not appear in the paper text.",
+        "llm_skipped": True
+    }
 
 # Paths
 output_root = Path("./output")
@@ -87,15 +122,25 @@ for folder in output_root.iterdir():
     relationships = load_json(val_path)
 
     validated_output = []
+    index = build_sentence_index(text, relationships)
+    skipped = 0
 
     for rel in relationships:
         source = rel.get("source", "")
         target = rel.get("target", "")
         relation = rel.get("requested_relation", "")
 
-        # Generate prompt
         keywords = [source.lower(), target.lower()]
-        context = filter_context(text, keywords)
+        source_present, target_present = index.contains(keywords[0]), index.contains(keywords[1])
+        if not (source_present and target_present):
+            data = absent_verdict(source_present, target_present)
+            data.update({"source": source, "target": target, "relation": relation})
+            validated_output.append(data)
+            skipped += 1
+            continue
+
+        # Generate prompt: sentences mentioning both entities first, then either
+        context = index.context(keywords, MAX_CONTEXT_CHARS)
         prompt = prompt_template.format(
             context=context,
             source=source,
@@ -105,22 +150,23 @@ for folder in output_root.iterdir():
 
         # Query the model
         try:
-            response = llm.invoke(prompt)
-            content = response.content if hasattr(response, "content") else str(response)
+            content = response_text(llm.invoke(prompt))
             
             
             print(f"Raw response: {content}")
-            
-            content = re.sub(r"```json|```", "", content).strip()
-            data = json.loads(content)
+
+            data, fragments = parse_validation(content)
+            if data is None and fragments:
+                data = repair_validation(fragments)
+            if data is None:
+                print(f"❌ No valid verdict for ({source}, {relation}, {target})\nResponse was: {content}")
+                continue
             data.update({
                 "source": source,
                 "target": target,
                 "relation": relation
             })
             validated_output.append(data)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON decode error for ({source}, {relation}, {target}): {e}\nResponse was: {content}")
         except Exception as e:
             print(f"❌ Error validating ({source}, {relation}, {target}): {str(e)}")
 
@@ -129,4 +175,4 @@ for folder in output_root.iterdir():
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(validated_output, f, indent=2, ensure_ascii=False)
 
-    print(f"✅ Saved: {out_path} ({len(validated_output)} validated)")
+    print(f"✅ Saved: {out_path} ({len(validated_output)} validated, {skipped} without an LLM call)")
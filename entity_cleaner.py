@@ -58,11 +58,14 @@ def clean_entities(input_file, cleaned_output, final_output, score_threshold=0.8
         key = (text.lower(), label)
         if key not in seen:
             seen.add(key)
-            cleaned.append({
+            entry = {
                 'text': text,
                 'label': label,
                 'score': round(float(score), 4)
-            })
+            }
+            if 'concept_ids' in entity:
+                entry['concept_ids'] = entity['concept_ids']   # from the NCIt dictionary tagger
+            cleaned.append(entry)
 
     # Output cleaned entities (full + text-only)
     with open(cleaned_output, 'w', encoding='utf-8') as f:
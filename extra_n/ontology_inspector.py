@@ -1,11 +1,44 @@
+import argparse
+import json
+import os
 import pickle
+import sys
+import xml.etree.ElementTree as ET
 from collections import defaultdict
 from pathlib import Path
-from rdflib import Graph, URIRef, Namespace
-from rdflib.namespace import RDFS, SKOS
+from urllib.parse import urljoin
+from rapidfuzz import process, fuzz
+from tqdm import tqdm
 
+# Shared index format lives in the project root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from ncit_index import CompactNCItIndex, COMPACT_INDEX_PATH, SUBCLASS_PREDICATE
+
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+RDFS = "http://www.w3.org/2000/01/rdf-schema#"
+OWL = "http://www.w3.org/2002/07/owl#"
+SKOS = "http://www.w3.org/2004/02/skos/core#"
 # Optional synonym property from OBO ontologies
-OBOINOWL = Namespace("http://www.geneontology.org/formats/oboInOwl#")
+OBOINOWL = "http://www.geneontology.org/formats/oboInOwl#"
+XML_NS = "{http://www.w3.org/XML/1998/namespace}"
+XML_BASE = XML_NS + "base"
+
+RDF_ABOUT = f"{{{RDF}}}about"
+RDF_ID = f"{{{RDF}}}ID"
+RDF_RESOURCE = f"{{{RDF}}}resource"
+RDF_NODE_ID = f"{{{RDF}}}nodeID"
+RDF_PARSE_TYPE = f"{{{RDF}}}parseType"
+RDF_DESCRIPTION = f"{{{RDF}}}Description"
+RDF_TYPE = RDF + "type"
+RDFS_LABEL = RDFS + "label"
+OWL_ONTOLOGY = OWL + "Ontology"
+OWL_VERSION_INFO = OWL + "versionInfo"
+
+LABEL_PREDICATES = {RDFS_LABEL, SKOS + "altLabel", OBOINOWL + "hasExactSynonym"}
+PROPERTY_TYPES = {
+    RDF + "Property", OWL + "ObjectProperty", OWL + "DatatypeProperty",
+    OWL + "AnnotationProperty", OWL + "TransitiveProperty", OWL + "FunctionalProperty",
+}
 
 def normalize_text(text):
     """Lowercase and strip special characters for consistent indexing."""
@@ -15,53 +48,315 @@ def normalize_text(text):
     text = re.sub(r'\s{2,}', ' ', text)       # multiple spaces to single
     return text.strip()
 
+def tag_uri(tag):
+    """'{namespace}local' -> 'namespacelocal'"""
+    return tag[1:].replace("}", "", 1) if tag.startswith("{") else tag
+
+def local_id(uri):
+    return uri.split("#")[-1]
+
+
+class ProgressReader:
+    """File wrapper that advances a tqdm bar by the number of bytes read."""
+
+    def __init__(self, f, bar):
+        self.f = f
+        self.bar = bar
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bar.update(len(data))
+        return data
+
+
 class NCItInspector:
+    """Builds the NCIt indexes in a single streaming pass over the RDF/XML OWL file.
+
+    Each top-level element is indexed as soon as it is parsed and then discarded,
+    so memory is bounded by the indexes themselves rather than the full graph.
+    """
+
     def __init__(self, owl_path="./ncit/Cancer_Thesaurus.owl"):
-        self.g = Graph()
-        self.g.parse(owl_path)
-        print(f"Loaded ontology with {len(self.g)} triples")
+        self.owl_path = owl_path
+        self.base = ""
+        self.version = None                  # owl:versionInfo of the ontology header
 
-    def build_and_save_indexes(self, output_path="ncit_indexes.pkl"):
-        print("🔍 Building entity and relationship indexes...")
-        
+    def build_indexes(self, progress=True):
+        """Stream the OWL file: returns (entity_index, rel_index, predicate_labels)."""
         entity_index = defaultdict(list)     # {text: [C12345, ...]}
         rel_index = defaultdict(set)         # {(C123, C456): {rel_code}}
-        predicate_labels = {}                # {rel_code: label}
-
-        for s, p, o in self.g:
-            # --- ENTITY LABEL INDEX ---
-            if p in [RDFS.label, SKOS.altLabel, OBOINOWL.hasExactSynonym]:
-                if isinstance(s, URIRef) and isinstance(o, str):
-                    concept_id = s.split("#")[-1]  # e.g. C12345
-                    norm_text = normalize_text(o)
-                    if norm_text:
-                        entity_index[norm_text].append(concept_id)
-
-            # --- RELATIONSHIP INDEX ---
-            if isinstance(s, URIRef) and isinstance(o, URIRef):
-                subj_id = s.split("#")[-1]
-                obj_id = o.split("#")[-1]
-                pred_id = p.split("#")[-1]
-                rel_index[(subj_id, obj_id)].add(pred_id)
-
-                # Label of relation
-                if pred_id not in predicate_labels:
-                    label = next(self.g.objects(p, RDFS.label), None)
-                    if isinstance(label, str):
-                        predicate_labels[pred_id] = label
-
-        print(f"✅ Indexed {len(entity_index)} terms and {len(rel_index)} relationships")
-
-        # Save
-        with open(output_path, 'wb') as f:
-            pickle.dump({
-                "entity_index": dict(entity_index),
-                "rel_index": dict(rel_index),
-                "predicate_labels": predicate_labels
-            }, f)
-
-        print(f"📦 Saved index to {output_path}")
+        property_labels = {}                 # {rel_code: label} for every declared property
+
+        with open(self.owl_path, "rb") as raw, tqdm(
+            total=os.path.getsize(self.owl_path), unit="B", unit_scale=True,
+            desc="Indexing OWL", disable=not progress
+        ) as bar:
+            depth = 0
+            root = None
+            for event, elem in ET.iterparse(ProgressReader(raw, bar), events=("start", "end")):
+                if event == "start":
+                    if depth == 0:
+                        root = elem
+                        self.base = elem.get(XML_BASE, "")
+                    depth += 1
+                    continue
+
+                depth -= 1
+                if depth == 1:
+                    self._index_node(elem, entity_index, rel_index, property_labels)
+                    root.clear()
+
+        used_predicates = {p for preds in rel_index.values() for p in preds}
+        predicate_labels = {p: label for p, label in property_labels.items() if p in used_predicates}
+        return dict(entity_index), dict(rel_index), predicate_labels
+
+    def _resolve(self, uri):
+        return urljoin(self.base, uri) if self.base else uri
+
+    def _subject_uri(self, node):
+        if node.get(RDF_ABOUT) is not None:
+            return self._resolve(node.get(RDF_ABOUT))
+        if node.get(RDF_ID) is not None:
+            return self._resolve("#" + node.get(RDF_ID))
+        return None  # blank node
+
+    def _index_node(self, node, entity_index, rel_index, property_labels):
+        """Index the triples of one RDF/XML node element (recursing into nested nodes).
+
+        Only triples whose subject is a named resource are kept: labels/synonyms
+        with literal objects and relations whose object is a named resource.
+        """
+        subject = self._subject_uri(node)
+        subject_id = local_id(subject) if subject else None
+        types = [] if node.tag == RDF_DESCRIPTION else [tag_uri(node.tag)]
+        literals = [(tag_uri(k), v) for k, v in node.attrib.items()
+                    if k.startswith("{") and not k.startswith((f"{{{RDF}}}", XML_NS))]
+
+        for child in node:
+            pred = tag_uri(child.tag)
+            obj = None
+            if child.get(RDF_RESOURCE) is not None:
+                obj = self._resolve(child.get(RDF_RESOURCE))
+            elif child.get(RDF_PARSE_TYPE) in ("Resource", "Literal") or child.get(RDF_NODE_ID) is not None:
+                continue  # blank node or XML literal object
+            elif len(child):
+                nested = [self._index_node(n, entity_index, rel_index, property_labels) for n in child]
+                if len(nested) == 1 and child.get(RDF_PARSE_TYPE) is None:
+                    obj = nested[0]
+            else:
+                literals.append((pred, child.text or ""))
+                continue
+
+            if obj is None:
+                continue
+            if pred == RDF_TYPE:
+                types.append(obj)
+            elif subject:
+                rel_index[(subject_id, local_id(obj))].add(local_id(pred))
+
+        if not subject:
+            return None
+
+        # --- RELATIONSHIP INDEX (rdf:type is a relation too) ---
+        for t in types:
+            rel_index[(subject_id, local_id(t))].add(local_id(RDF_TYPE))
+
+        # --- ENTITY LABEL INDEX ---
+        seen = set()
+        for pred, text in literals:
+            if pred in LABEL_PREDICATES:
+                norm_text = normalize_text(text)
+                if norm_text and (pred, norm_text) not in seen:
+                    seen.add((pred, norm_text))
+                    entity_index[norm_text].append(subject_id)
+
+        # Release stamp
+        if OWL_ONTOLOGY in types:
+            self.version = next((text.strip() for pred, text in literals if pred == OWL_VERSION_INFO), self.version)
+
+        # Label of relation
+        if PROPERTY_TYPES.intersection(types):
+            label = next((text for pred, text in literals if pred == RDFS_LABEL), None)
+            if label is not None and subject_id not in property_labels:
+                property_labels[subject_id] = label
+
+        return subject
+
+    def build_and_save_indexes(self, output_path="ncit_indexes.pkl", compact_path=COMPACT_INDEX_PATH):
+        print("🔍 Building entity and relationship indexes...")
+
+        entity_index, rel_index, predicate_labels = self.build_indexes()
+
+        print(f"✅ Indexed {len(entity_index)} terms and {len(rel_index)} relationships (version {self.version})")
+
+        save_indexes(entity_index, rel_index, predicate_labels, self.version, output_path, compact_path)
+
+    def update_indexes(self, previous_path="ncit_indexes.pkl", output_path="ncit_indexes.pkl",
+                       compact_path=COMPACT_INDEX_PATH, output_root="output",
+                       report_path="ncit_update_report.json"):
+        """Rebuild the indexes from this OWL release and report what changed since a previous index.
+
+        The fresh build is saved as is; the diff against the previous index only
+        drives the report of added/removed labels, synonyms and relations and of
+        the relationships already validated under output_root that they can affect.
+        """
+        with open(previous_path, 'rb') as f:
+            previous = pickle.load(f)
+
+        print(f"🔍 Diffing {self.owl_path} against {previous_path} (version {previous.get('version')})...")
+        entity_index, rel_index, predicate_labels = self.build_indexes()
+        changes = diff_indexes(
+            previous['entity_index'], previous['rel_index'], entity_index, rel_index,
+            previous.get('predicate_labels', {}), predicate_labels
+        )
+
+        del previous['rel_index']   # only the old labels are needed for the report
+
+        print(f"✅ {len(changes['labels'])} terms and {len(changes['relations'])} relationships changed "
+              f"({previous.get('version')} → {self.version})")
+
+        index = save_indexes(entity_index, rel_index, predicate_labels, self.version, output_path, compact_path)
+
+        affected = find_affected_relationships(changes, previous['entity_index'], index, output_root)
+        total = sum(len(rels) for rels in affected.values())
+        print(f"🧪 {total} validated relationships in {len(affected)} papers need re-validation")
+
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "previous_version": previous.get('version'),
+                "version": self.version,
+                "label_changes": changes['labels'],
+                "relation_changes": [
+                    {"source_id": s, "target_id": t, **change} for (s, t), change in changes['relations'].items()
+                ],
+                "relation_label_changes": changes['predicates'],
+                "affected_relationships": affected
+            }, f, indent=2, ensure_ascii=False)
+
+        print(f"📄 Saved update report to {report_path}")
+        return affected
+
+
+def save_indexes(entity_index, rel_index, predicate_labels, version, output_path, compact_path):
+    with open(output_path, 'wb') as f:
+        pickle.dump({
+            "entity_index": entity_index,
+            "rel_index": rel_index,
+            "predicate_labels": predicate_labels,
+            "version": version
+        }, f)
+
+    print(f"📦 Saved index to {output_path}")
+
+    # Compact memory-mappable copy read by ontology_validator
+    index = CompactNCItIndex.from_dicts(entity_index, rel_index, predicate_labels, version=version)
+    index.save(compact_path)
+    print(f"📦 Saved compact index to {compact_path}")
+    return index
+
+
+def diff_indexes(old_entities, old_relations, new_entities, new_relations,
+                 old_predicate_labels=None, new_predicate_labels=None):
+    """Per-term concept, per-pair predicate and relation label differences between two index versions."""
+    labels = {}
+    for term in old_entities.keys() | new_entities.keys():
+        old_ids, new_ids = set(old_entities.get(term, ())), set(new_entities.get(term, ()))
+        if old_ids != new_ids:
+            labels[term] = {"added": sorted(new_ids - old_ids), "removed": sorted(old_ids - new_ids)}
+
+    relations = {}
+    for pair in old_relations.keys() | new_relations.keys():
+        old_preds, new_preds = set(old_relations.get(pair, ())), set(new_relations.get(pair, ()))
+        if old_preds != new_preds:
+            relations[pair] = {"added": sorted(new_preds - old_preds), "removed": sorted(old_preds - new_preds)}
+
+    old_predicate_labels, new_predicate_labels = old_predicate_labels or {}, new_predicate_labels or {}
+    predicates = {
+        code: {"old": old_predicate_labels.get(code), "new": new_predicate_labels.get(code)}
+        for code in old_predicate_labels.keys() | new_predicate_labels.keys()
+        if old_predicate_labels.get(code) != new_predicate_labels.get(code)
+    }
+
+    return {"labels": labels, "relations": relations, "predicates": predicates}
+
+
+def find_affected_relationships(changes, old_entities, index, output_root="output", threshold=85):
+    """{paper: [validated relationships whose outcome may change under `changes`]}
+
+    index is the new compact index. Relation changes count when they connect any
+    concept of the source's subClassOf closure to any of the target's (so edges
+    inherited from ancestors are covered), and subClassOf changes count when they
+    touch a concept of either closure.
+    """
+    changed_terms = list(changes['labels'])
+    changed_predicates = set(changes['predicates'])
+    changed_targets = defaultdict(set)      # {source: {targets}} of changed relations
+    hierarchy_changed = set()               # concepts whose parents changed
+    for (s, t), change in changes['relations'].items():
+        changed_targets[s].add(t)
+        if SUBCLASS_PREDICATE in change['added'] or SUBCLASS_PREDICATE in change['removed']:
+            hierarchy_changed.add(s)
+
+    closures = {}
+
+    def closure(ids):
+        """Resolved IDs plus all their ancestors in the new release."""
+        concepts = set()
+        for concept_id in ids:
+            if concept_id not in closures:
+                closures[concept_id] = {concept_id, *index.ancestors(concept_id)}
+            concepts |= closures[concept_id]
+        return concepts
+
+    def entity_reasons(text):
+        norm = normalize_text(text)
+        if norm in changes['labels']:
+            return ["label changed"]
+        if norm not in old_entities and changed_terms and process.extractOne(
+                norm, changed_terms, scorer=fuzz.ratio, processor=None, score_cutoff=threshold):
+            return ["fuzzy match candidates changed"]
+        return []
+
+    affected = {}
+    for path in sorted(Path(output_root).glob("*/validated_relationships.json")):
+        with open(path, encoding='utf-8') as f:
+            validated = json.load(f)
+
+        paper_affected = []
+        for i, rel in enumerate(validated):
+            reasons = entity_reasons(rel['source']) + entity_reasons(rel['target'])
+            source_closure, target_closure = closure(rel.get('source_ids', [])), closure(rel.get('target_ids', []))
+            if any(changed_targets[s] & target_closure for s in source_closure if s in changed_targets):
+                reasons.append("relations changed")
+            if hierarchy_changed & (source_closure | target_closure):
+                reasons.append("hierarchy changed")
+            if any(r.get('code') in changed_predicates for r in rel.get('all_relationships', [])):
+                reasons.append("relation labels changed")
+            if reasons:
+                paper_affected.append({
+                    "index": i,
+                    "source": rel['source'],
+                    "relation": rel.get('requested_relation'),
+                    "target": rel['target'],
+                    "reasons": sorted(set(reasons))
+                })
+
+        if paper_affected:
+            affected[path.parent.name] = paper_affected
+
+    return affected
+
 
 if __name__ == "__main__":
-    inspector = NCItInspector()
-    inspector.build_and_save_indexes()
+    parser = argparse.ArgumentParser(description="Build NCIt indexes from Cancer_Thesaurus.owl")
+    parser.add_argument("--owl", default="./ncit/Cancer_Thesaurus.owl")
+    parser.add_argument("--update", action="store_true",
+                        help="rebuild, then report the changes against the existing index and the affected relationships")
+    parser.add_argument("--previous", default="ncit_indexes.pkl", help="index to update (with --update)")
+    args = parser.parse_args()
+
+    inspector = NCItInspector(args.owl)
+    if args.update:
+        inspector.update_indexes(previous_path=args.previous)
+    else:
+        inspector.build_and_save_indexes()
@@ -0,0 +1,108 @@
+# llm_dispatch.py
+
+import asyncio
+import os
+import random
+import time
+from dotenv import load_dotenv
+
+# Limits may come from .env, which must be loaded before they are read below
+load_dotenv()
+
+# Rate limits for the OpenAI backend (set them to your account tier)
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))           # requests per minute
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "30000"))         # prompt + completion tokens per minute
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+# A local Ollama server has no quota but only serves a few requests at once
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0        # seconds
+BACKOFF_MAX = 60.0
+RETRYABLE_NAMES = ("RateLimit", "Timeout", "APIConnection", "ConnectError", "ServiceUnavailable", "InternalServer")
+
+
+class TokenBucket:
+    """Refills `rate` units per minute up to `rate`; callers wait until their amount is available."""
+
+    def __init__(self, rate):
+        self.capacity = rate
+        self.tokens = rate
+        self.per_second = rate / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)   # a request larger than the bucket waits for a full one
+        async with self.lock:                 # first come, first served
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.per_second)
+
+
+def status_code(error):
+    """HTTP status carried by an API client exception, if any."""
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+def is_retryable(error):
+    """429s, 5xx responses and connection problems are worth retrying; other errors are not."""
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    return any(name in type(error).__name__ for name in RETRYABLE_NAMES)
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LLMDispatcher:
+    """Runs blocking LLM calls concurrently under rate limits, a concurrency cap and retries.
+
+    Each call first takes one request from the requests-per-minute bucket and its
+    estimated tokens from the tokens-per-minute bucket, then waits for a free slot.
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_concurrency=4, max_retries=MAX_RETRIES):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.calls = self.retries = 0
+
+    async def call(self, fn, *args, tokens=0):
+        """await fn(*args) in a worker thread, retrying rate-limit and server errors."""
+        for attempt in range(self.max_retries + 1):
+            if self.requests:
+                await self.requests.acquire(1)
+            if self.tokens and tokens:
+                await self.tokens.acquire(tokens)
+            async with self.slots:
+                try:
+                    self.calls += 1
+                    return await asyncio.to_thread(fn, *args)
+                except Exception as e:
+                    if attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    delay = backoff_delay(attempt)
+                    code = status_code(e)
+                    print(f"⏳ {type(e).__name__}{f' ({code})' if code else ''}; retrying in {delay:.1f}s")
+                    self.retries += 1
+            await asyncio.sleep(delay)   # back off without holding a slot
+
+
+def dispatcher_for(backend):
+    """Dispatcher with the limits of a backend ('openai' or 'ollama')."""
+    if backend == "openai":
+        return LLMDispatcher(rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_concurrency=OPENAI_MAX_CONCURRENCY)
+    return LLMDispatcher(max_concurrency=OLLAMA_MAX_CONCURRENCY)
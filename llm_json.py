@@ -0,0 +1,218 @@
+# llm_json.py
+
+import json
+import os
+import re
+import threading
+
+CODE_FENCE = re.compile(r'```(?:json)?')
+
+# Repair requests: one per response at most, and at most this many per process
+REPAIR_BUDGET = int(os.getenv("LLM_REPAIR_BUDGET", "50"))
+MAX_FRAGMENT_CHARS = 4000     # unrecovered text sent in one repair request
+
+REPAIR_PROMPT = """The JSON below is malformed. Rewrite it as valid JSON in this format:
+{schema}
+
+Only fix the syntax. Do not add, remove or change any values; leave out items that are incomplete.
+Output ONLY the JSON with no additional commentary.
+
+{fragments}
+"""
+
+
+class JSONObjectStream:
+    """Incremental parser for a JSON array of objects arriving in pieces.
+
+    feed() returns every top-level object completed by the new text, so callers
+    can act on each one as soon as its closing brace arrives. Text around the
+    objects (markdown fences, the array brackets, commentary) is ignored, and an
+    object cut off by a truncated response is simply never returned.
+    """
+
+    def __init__(self):
+        self.depth = 0            # brace depth; 0 means between objects
+        self.in_string = False
+        self.escaped = False
+        self.current = []         # characters of the object being read
+        self.failed = []          # complete objects that were not valid JSON
+
+    @property
+    def errors(self):
+        return len(self.failed)
+
+    @property
+    def pending(self):
+        """Text of an object that has been opened but not closed yet."""
+        return "".join(self.current) if self.depth else ""
+
+    def feed(self, text):
+        completed = []
+        for ch in text:
+            if self.depth == 0:
+                if ch == "{":
+                    self.depth = 1
+                    self.current = [ch]
+                continue
+
+            self.current.append(ch)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    obj = self._load("".join(self.current))
+                    if obj is not None:
+                        completed.append(obj)
+        return completed
+
+    def _load(self, text):
+        try:
+            return json.loads(fix_json(text))
+        except json.JSONDecodeError:
+            self.failed.append(text)
+            return None
+
+
+class RepairBudget:
+    """Thread-safe count of the repair requests a process may still send."""
+
+    def __init__(self, limit=REPAIR_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self.denied = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.used >= self.limit:
+                self.denied += 1
+                return False
+            self.used += 1
+            return True
+
+repair_budget = RepairBudget()
+
+
+def fix_json(json_str):
+    """Fix common JSON issues before parsing: drop comments and trailing commas.
+
+    Only text outside strings is touched, so values such as URLs keep their "//".
+    """
+    out = []
+    i, n = 0, len(json_str)
+    in_string = escaped = False
+    while i < n:
+        ch = json_str[i]
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif json_str.startswith("//", i):          # line comment
+            end = json_str.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        elif json_str.startswith("/*", i):          # block comment
+            end = json_str.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            continue
+        elif ch == ",":
+            j = i + 1
+            while j < n and json_str[j].isspace():
+                j += 1
+            if j == n or json_str[j] not in "}]":   # keep unless it is a trailing comma
+                out.append(ch)
+        else:
+            out.append(ch)
+        i += 1
+    return "".join(out)
+
+def parse_objects(text):
+    """Every complete top-level JSON object in text, even if the array around them is broken."""
+    return JSONObjectStream().feed(text)
+
+def close_fragment(fragment):
+    """Parse an object cut off by a truncated response by closing its open brackets.
+
+    Returns None when the cut falls inside a string, a key or a number, since the
+    last value may then be incomplete.
+    """
+    stack, in_string, escaped = [], False, False
+    for ch in fragment:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    body = fragment.rstrip()
+    if in_string or not body or body[-1] not in '"}]el,{[':   # ends in a closed string, true/false/null or a container
+        return None
+    body = body.rstrip(",")
+    try:
+        return json.loads(body + "".join(reversed(stack)))
+    except json.JSONDecodeError:
+        return None
+
+def salvage_json(text):
+    """(objects, fragments) recovered from a raw LLM response.
+
+    objects are the items of the JSON array (or the single object) when the whole
+    response parses, otherwise every well-formed top-level object in it plus a
+    truncated last object whose values are complete. fragments are the pieces
+    that could not be recovered: malformed objects, or the whole response when
+    it holds no JSON object at all.
+    """
+    cleaned = CODE_FENCE.sub("", text).strip()
+    for candidate in (cleaned, fix_json(cleaned)):
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return (data if isinstance(data, list) else [data]), []
+
+    stream = JSONObjectStream()
+    objects = stream.feed(fix_json(cleaned))
+    fragments = list(stream.failed)
+    if stream.pending:
+        closed = close_fragment(stream.pending)
+        if closed is not None:
+            objects.append(closed)
+    if not objects and not fragments and cleaned:
+        fragments.append(cleaned)
+    return objects, fragments
+
+def repair_prompt(fragments, schema):
+    """Short prompt asking the model to fix only the unrecovered fragments, or None if there are none."""
+    selected, size = [], 0
+    for fragment in fragments:
+        if selected and size + len(fragment) > MAX_FRAGMENT_CHARS:
+            break
+        selected.append(fragment[:MAX_FRAGMENT_CHARS])
+        size += len(selected[-1])
+    if not selected:
+        return None
+    return REPAIR_PROMPT.format(schema=schema, fragments="\n".join(selected))
@@ -0,0 +1,145 @@
+# llm_provider.py
+
+import os
+import threading
+from functools import lru_cache
+import tiktoken
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_MODELS = {
+    "openai": "gpt-4o",
+    "ollama": "llama3.3:latest",
+}
+
+# Every Ollama client uses the same context size, so the server keeps one loaded
+# instance (and its KV cache of the shared prompt prefix) instead of reloading the
+# model whenever num_ctx changes; keep_alive stops it being unloaded between papers.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "32768"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class UsageStats:
+    """Token usage across calls, including prompt tokens served from the provider's cache.
+
+    OpenAI reports cached prompt tokens directly. Ollama only reports the prompt
+    tokens it evaluated and the time spent, both of which drop when its KV
+    cache reuses a prefix.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}   # {backend: {calls, prompt_tokens, cached_tokens, completion_tokens, prompt_seconds}}
+
+    def record(self, backend, prompt_tokens=0, cached_tokens=0, completion_tokens=0, prompt_seconds=0.0):
+        with self.lock:
+            totals = self.totals.setdefault(backend, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                                                      "completion_tokens": 0, "prompt_seconds": 0.0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens or 0
+            totals["cached_tokens"] += cached_tokens or 0
+            totals["completion_tokens"] += completion_tokens or 0
+            totals["prompt_seconds"] += prompt_seconds or 0.0
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for backend, totals in self.totals.items():
+                summary[backend] = dict(totals)
+                prompt_tokens = totals["prompt_tokens"]
+                summary[backend]["cached_ratio"] = round(totals["cached_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0
+            return summary
+
+    def report(self):
+        for backend, totals in self.summary().items():
+            if backend == "openai":
+                print(f"📊 openai: {totals['calls']} calls, {totals['prompt_tokens']} prompt tokens "
+                      f"({totals['cached_ratio']:.0%} cached), {totals['completion_tokens']} completion tokens")
+            else:
+                print(f"📊 ollama: {totals['calls']} calls, {totals['prompt_tokens']} prompt tokens evaluated "
+                      f"in {totals['prompt_seconds']:.1f}s, {totals['completion_tokens']} completion tokens")
+
+usage = UsageStats()
+
+
+def _client_key(backend, model, params):
+    return backend, model, tuple(sorted((k, repr(v)) for k, v in params.items()))
+
+def _build_client(backend, model, params):
+    if backend == "openai":
+        from langchain_openai import ChatOpenAI
+        api_key = os.getenv("OPENAI_API_KEY") or os.getenv("API_KEY")
+        return ChatOpenAI(model=model, api_key=api_key, stream_usage=True, **params)
+    from langchain_ollama import OllamaLLM
+    options = {"keep_alive": OLLAMA_KEEP_ALIVE, "num_ctx": OLLAMA_NUM_CTX}
+    options.update(params)
+    return OllamaLLM(model=model, **options)
+
+def record_usage(backend, response=None, generation_info=None):
+    """Add a response's token usage (chat message metadata or Ollama generation info) to `usage`."""
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata:
+        cached = (metadata.get("input_token_details") or {}).get("cache_read", 0)
+        usage.record(backend, metadata.get("input_tokens", 0), cached, metadata.get("output_tokens", 0))
+    elif generation_info:
+        usage.record(backend, generation_info.get("prompt_eval_count", 0), 0, generation_info.get("eval_count", 0),
+                     (generation_info.get("prompt_eval_duration") or 0) / 1e9)
+
+def get_llm(backend="ollama", model=None, **params):
+    """Shared LangChain client for a backend/model/parameters, built once per process.
+
+    Reusing one client keeps its HTTP connection pool (and TLS sessions) alive
+    across calls; the clients are safe to use from several threads.
+    """
+    backend = "openai" if backend == "openai" else "ollama"
+    model = DEFAULT_MODELS[backend] if model is None else model
+    key = _client_key(backend, model, params)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _build_client(backend, model, params)
+    return client
+
+def response_text(response):
+    """Text of a chat message or plain completion."""
+    if hasattr(response, "content"):
+        return response.content
+    if hasattr(response, "text") and isinstance(response.text, str):
+        return response.text
+    return str(response)
+
+def invoke(prompt, backend="ollama", model=None, **params):
+    """Blocking call; returns the response text and records its token usage."""
+    llm = get_llm(backend, model, **params)
+    if backend == "openai":
+        response = llm.invoke(prompt)
+        record_usage(backend, response)
+        return response_text(response)
+    # generate() keeps Ollama's generation info (prompt_eval_count, durations)
+    generation = llm.generate([prompt]).generations[0][0]
+    record_usage("ollama", generation_info=generation.generation_info or {})
+    return generation.text
+
+def stream(prompt, backend="ollama", model=None, **params):
+    """Yield the response text piece by piece as it is generated."""
+    for chunk in get_llm(backend, model, **params).stream(prompt):
+        if getattr(chunk, "usage_metadata", None):
+            record_usage(backend, chunk)   # sent with the last chunk
+        yield response_text(chunk)
+
+async def ainvoke(prompt, backend="ollama", model=None, **params):
+    """Async call; returns the response text."""
+    response = await get_llm(backend, model, **params).ainvoke(prompt)
+    record_usage(backend, response)
+    return response_text(response)
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name="gpt-4o"):
+    """tiktoken encoding for a model, loaded once per process."""
+    return tiktoken.encoding_for_model(model_name)
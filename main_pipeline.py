@@ -1,18 +1,24 @@
+import asyncio
 import os
 import json
 from pathlib import Path
 
-from pdf_cleaner import process_all_pdfs
-from agent_entity_extractor import extract_entities_from_file
+from pdf_cleaner import process_pdfs
+from agent_entity_extractor import EntityExtractor, MODEL_NAME
 from entity_cleaner import clean_entities
-from agent_relationship_extractor import extract_relationships, read_text_file
-from ontology_validator import validate
+from agent_relationship_extractor import extract_relationships_corpus, read_text_file, llm_cache_stats, EXTRACTION_MODE
+from prompt_budget import load_entity_scores, PROMPT_TOKEN_BUDGET
+from ontology_validator import validate_corpus
 from agent_neo4j_adder import add_to_neo4j
+from pipeline_manifest import PipelineManifest, code_version, index_version
+from llm_provider import usage as llm_usage
 
 # === Paths ===
 CLEANED_DIR = Path("./dataset/cleaned_papers")
 RESEARCH_DIR = Path("./dataset/research_papers")
 OUTPUT_ROOT = Path("./output")
+NER_BACKEND = os.getenv("NER_BACKEND", "torch")   # 'torch', 'quantized' or 'onnx' (CPU inference)
+NER_MODE = os.getenv("NER_MODE", "transformer")   # 'transformer', 'dictionary' (NCIt tagger) or 'merged'
 
 
 # === User Input Helpers ===
@@ -35,55 +41,140 @@ def ask_store_in_neo4j():
 
 
 # === Pipeline Steps ===
-def clean_all_pdfs():
+# Each stage skips papers whose inputs, code and settings are unchanged since its
+# last run (see pipeline_manifest.py); a changed output re-runs only the stages reading it.
+def clean_all_pdfs(manifest=None):
     print("\n📚 Cleaning PDFs...")
-    process_all_pdfs(RESEARCH_DIR, CLEANED_DIR)
+    manifest = manifest or PipelineManifest()
+    version = code_version("pdf_cleaner")
+    CLEANED_DIR.mkdir(parents=True, exist_ok=True)
 
-def run_entity_extraction():
+    pdf_paths = sorted(RESEARCH_DIR.glob("*.pdf"))
+    if not pdf_paths:
+        print("❌ No PDFs found in the folder.")
+        return
+
+    jobs, fingerprints = [], {}
+    for pdf_path in pdf_paths:
+        output_path = CLEANED_DIR / f"{pdf_path.stem}.txt"
+        fingerprint = manifest.fingerprint([pdf_path], version)
+        if not manifest.is_current(pdf_path.stem, "clean", fingerprint, [output_path]):
+            jobs.append((str(pdf_path), str(output_path)))
+            fingerprints[str(pdf_path)] = fingerprint
+    manifest.report("clean", len(pdf_paths))
+
+    for stats in process_pdfs(jobs):
+        if not stats["error"]:
+            manifest.record(Path(stats["pdf"]).stem, "clean", fingerprints[stats["pdf"]])
+    manifest.save()
+
+def run_entity_extraction(manifest=None):
     print("\n🔍 Extracting entities from cleaned papers...")
-    for txt_file in CLEANED_DIR.glob("*.txt"):
-        paper_id = txt_file.stem
-        output_dir = OUTPUT_ROOT / paper_id
-        extract_entities_from_file(txt_file.name, output_dir)
+    manifest = manifest or PipelineManifest()
+    version = code_version("agent_entity_extractor", "ncit_tagger")
+    config = {"model": MODEL_NAME, "backend": NER_BACKEND, "mode": NER_MODE,
+              "index": index_version() if NER_MODE != "transformer" else None}
+
+    txt_paths = sorted(CLEANED_DIR.glob("*.txt"))
+    pending = {}   # {filename: fingerprint}
+    for txt_path in txt_paths:
+        output_path = OUTPUT_ROOT / txt_path.stem / "extracted_entities.json"
+        fingerprint = manifest.fingerprint([txt_path], version, config)
+        if not manifest.is_current(txt_path.stem, "ner", fingerprint, [output_path]):
+            pending[txt_path.name] = fingerprint
+    manifest.report("ner", len(txt_paths))
+    if not pending:
+        return
 
-def run_entity_cleaning():
-    print("\n🧹 Cleaning extracted entities...")
-    for folder in OUTPUT_ROOT.iterdir():
-        if folder.is_dir():
-            input_path = folder / "extracted_entities.json"
-            cleaned_output = folder / "cleaned_entities.json"
-            final_output = folder / "final_entities.json"
-            if input_path.exists():
-                clean_entities(input_path, cleaned_output, final_output)
+    extractor = EntityExtractor(backend=NER_BACKEND, mode=NER_MODE)
+    extractor.extract_corpus(list(pending), OUTPUT_ROOT)
+    for name, fingerprint in pending.items():
+        manifest.record(Path(name).stem, "ner", fingerprint)
+    manifest.save()
 
-def run_relationship_extraction(core_entity, backend):
+def run_entity_cleaning(manifest=None):
+    print("\n🧹 Cleaning extracted entities...")
+    manifest = manifest or PipelineManifest()
+    version = code_version("entity_cleaner")
+    folders = [folder for folder in OUTPUT_ROOT.iterdir() if folder.is_dir()]
+    for folder in folders:
+        input_path = folder / "extracted_entities.json"
+        cleaned_output = folder / "cleaned_entities.json"
+        final_output = folder / "final_entities.json"
+        if not input_path.exists():
+            continue
+        fingerprint = manifest.fingerprint([input_path], version)
+        if manifest.is_current(folder.name, "entity_cleaning", fingerprint, [cleaned_output, final_output]):
+            continue
+        clean_entities(input_path, cleaned_output, final_output)
+        manifest.record(folder.name, "entity_cleaning", fingerprint)
+    manifest.report("entity_cleaning", len(folders))
+    manifest.save()
+
+def run_relationship_extraction(core_entity, backend, manifest=None):
     print(f"\n🔗 Extracting relationships (core entity: {core_entity}) using [{backend}]...")
-    for folder in OUTPUT_ROOT.iterdir():
-        if folder.is_dir():
-            txt_path = CLEANED_DIR / f"{folder.name}.txt"
-            entity_path = folder / "final_entities.json"
-            output_path = folder / "extracted_relationships.json"
-
-            if not txt_path.exists() or not entity_path.exists():
-                continue
-
-            text = read_text_file(txt_path)
-            with open(entity_path, "r") as f:
-                entities = json.load(f)
-
-            relationships = extract_relationships(text, entities, core_entity, backend)
-
-            with open(output_path, "w") as f:
-                json.dump(relationships, f, indent=2)
-
-def run_validation():
+    manifest = manifest or PipelineManifest()
+    version = code_version("agent_relationship_extractor", "prompt_budget", "llm_json", "llm_provider", "llm_dispatch")
+    config = {"core_entity": core_entity, "backend": backend, "mode": EXTRACTION_MODE, "budget": PROMPT_TOKEN_BUDGET}
+    folders = [folder for folder in OUTPUT_ROOT.iterdir() if folder.is_dir()]
+    papers, fingerprints = [], {}
+    for folder in folders:
+        txt_path = CLEANED_DIR / f"{folder.name}.txt"
+        entity_path = folder / "final_entities.json"
+        scores_path = folder / "cleaned_entities.json"
+        output_path = folder / "extracted_relationships.json"
+
+        if not txt_path.exists() or not entity_path.exists():
+            continue
+        fingerprint = manifest.fingerprint([txt_path, entity_path, scores_path], version, config)
+        if manifest.is_current(folder.name, "relationships", fingerprint, [output_path]):
+            continue
+
+        text = read_text_file(txt_path)
+        with open(entity_path, "r") as f:
+            entities = json.load(f)
+        papers.append((folder.name, text, entities, load_entity_scores(scores_path)))
+        fingerprints[folder.name] = fingerprint
+    manifest.report("relationships", len(folders))
+
+    def save_relationships(name, relationships):
+        with open(OUTPUT_ROOT / name / "extracted_relationships.json", "w") as f:
+            json.dump(relationships, f, indent=2)
+        if relationships:   # failed LLM calls return [] and are retried on the next run
+            manifest.record(name, "relationships", fingerprints[name])
+
+    # All papers are in flight at once, paced by the backend's rate limits (llm_dispatch.py)
+    asyncio.run(extract_relationships_corpus(papers, core_entity, backend, on_result=save_relationships))
+    manifest.save()
+
+    stats = llm_cache_stats()
+    if stats:
+        print(f"🗃 LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%})")
+    llm_usage.report()
+
+def run_validation(manifest=None):
     print("\n🧪 Validating relationships with NCIt ontology...")
-    for folder in OUTPUT_ROOT.iterdir():
-        if folder.is_dir():
-            input_path = folder / "extracted_relationships.json"
-            output_path = folder / "validated_relationships.json"
-            if input_path.exists():
-                validate(str(input_path), str(output_path))
+    manifest = manifest or PipelineManifest()
+    version = code_version("ontology_validator", "ncit_index")
+    config = {"index": index_version()}
+    folders = [folder for folder in OUTPUT_ROOT.iterdir() if folder.is_dir()]
+    jobs, fingerprints = [], {}
+    for folder in folders:
+        input_path = folder / "extracted_relationships.json"
+        entities_path = folder / "cleaned_entities.json"   # tagger concept IDs
+        output_path = folder / "validated_relationships.json"
+        if not input_path.exists():
+            continue
+        fingerprint = manifest.fingerprint([input_path, entities_path], version, config)
+        if not manifest.is_current(folder.name, "validation", fingerprint, [output_path]):
+            jobs.append((input_path, output_path))
+            fingerprints[folder.name] = fingerprint
+    manifest.report("validation", len(folders))
+
+    validate_corpus(jobs)
+    for name, fingerprint in fingerprints.items():
+        manifest.record(name, "validation", fingerprint)
+    manifest.save()
 
 def run_neo4j_store():
     for folder in OUTPUT_ROOT.iterdir():
@@ -128,11 +219,12 @@ def main():
     core_entity = get_core_entity()
     backend = get_model_backend()
 
-    clean_all_pdfs()
-    run_entity_extraction()
-    run_entity_cleaning()
-    run_relationship_extraction(core_entity, backend)
-    run_validation()
+    manifest = PipelineManifest()
+    clean_all_pdfs(manifest)
+    run_entity_extraction(manifest)
+    run_entity_cleaning(manifest)
+    run_relationship_extraction(core_entity, backend, manifest)
+    run_validation(manifest)
 
     if ask_store_in_neo4j():
         run_neo4j_store()
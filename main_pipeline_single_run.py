@@ -1,3 +1,4 @@
+import os
 import json
 from pathlib import Path
 import argparse
@@ -5,16 +6,19 @@ import argparse
 # Import all your agents
 from main_pipeline import main as main_pipeline
 from pdf_cleaner import process_all_pdfs
-from agent_entity_extractor import extract_entities_from_file
+from agent_entity_extractor import EntityExtractor
 from entity_cleaner import clean_entities
 from agent_relationship_extractor import extract_relationships, read_text_file
-from ontology_validator import validate
+from prompt_budget import load_entity_scores
+from ontology_validator import validate_corpus
 from agent_neo4j_adder import add_to_neo4j
 
 # Path configurations
 CLEANED_DIR = Path("./dataset/cleaned_papers")
 RESEARCH_DIR = Path("./dataset/research_papers")
 OUTPUT_ROOT = Path("./output")
+NER_BACKEND = os.getenv("NER_BACKEND", "torch")   # 'torch', 'quantized' or 'onnx' (CPU inference)
+NER_MODE = os.getenv("NER_MODE", "transformer")   # 'transformer', 'dictionary' (NCIt tagger) or 'merged'
 
 def show_menu():
     print("\n=== Step Selection ===")
@@ -35,10 +39,8 @@ def run_selected_step(choice, core_entity=None, backend=None):
     
     elif choice == "2":
         print("\n🔍 Running Entity Extraction...")
-        for txt_file in CLEANED_DIR.glob("*.txt"):
-            paper_id = txt_file.stem
-            output_dir = OUTPUT_ROOT / paper_id
-            extract_entities_from_file(txt_file.name, output_dir)
+        extractor = EntityExtractor(backend=NER_BACKEND, mode=NER_MODE)
+        extractor.extract_corpus([txt_file.name for txt_file in CLEANED_DIR.glob("*.txt")], OUTPUT_ROOT)
     
     elif choice == "3":
         print("\n🧹 Running Entity Cleaning...")
@@ -67,18 +69,22 @@ def run_selected_step(choice, core_entity=None, backend=None):
                     text = read_text_file(txt_path)
                     with open(entity_path, "r") as f:
                         entities = json.load(f)
-                    relationships = extract_relationships(text, entities, core_entity, backend)
+                    entity_scores = load_entity_scores(folder / "cleaned_entities.json")
+                    relationships = extract_relationships(text, entities, core_entity, backend,
+                                                          entity_scores=entity_scores)
                     with open(output_path, "w") as f:
                         json.dump(relationships, f, indent=2)
     
     elif choice == "5":
         print("\n🧪 Running Ontology Validation...")
+        jobs = []
         for folder in OUTPUT_ROOT.iterdir():
             if folder.is_dir():
                 input_path = folder / "extracted_relationships.json"
                 output_path = folder / "validated_relationships.json"
                 if input_path.exists():
-                    validate(str(input_path), str(output_path))
+                    jobs.append((input_path, output_path))
+        validate_corpus(jobs)
     
     elif choice == "6":
         print("\n🛢️ Storing in Neo4j...")
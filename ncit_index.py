@@ -0,0 +1,406 @@
+import json
+import pickle
+import time
+from pathlib import Path
+import numpy as np
+
+COMPACT_INDEX_PATH = "ncit_index"
+FORMAT_VERSION = 4
+SUBCLASS_PREDICATE = "subClassOf"
+
+# Arrays stored as one .npy file each so they can be memory-mapped independently
+ARRAY_NAMES = [
+    "concepts",        # sorted concept IDs (bytes)
+    "term_lengths",    # character length of each term, ascending
+    "term_offsets",    # byte offsets of each term inside term_blob (T + 1)
+    "term_blob",       # UTF-8 bytes of all terms, sorted by (length, bytes)
+    "term_ptr",        # CSR row pointer: term -> term_concepts (T + 1)
+    "term_concepts",   # concept indexes per term, in original index order
+    "term_ranks",      # position of each term in the original entity_index order (fuzzy tie-breaks)
+    "rel_ptr",         # CSR row pointer: source concept -> relation entries (C + 1)
+    "rel_targets",     # target concept index per entry, sorted within each row
+    "rel_preds",       # predicate index per entry
+    "rev_ptr",         # CSR row pointer: target concept -> rev_sources (C + 1)
+    "rev_sources",     # source concept index per incoming relation, sorted within each row
+    "anc_ptr",         # CSR row pointer: concept -> anc_ids (C + 1)
+    "anc_ids",         # transitive subClassOf ancestors per concept, sorted
+]
+
+
+class CompactNCItIndex:
+    """NCIt indexes as flat integer arrays (interned IDs, sorted term table, CSR relations).
+
+    Loaded from disk with memory mapping, so startup is near-instant and several
+    processes reading the same index share its pages through the OS cache.
+    """
+
+    def __init__(self, arrays, meta):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.predicates = meta["predicates"]                 # [REL_TYPE] by predicate index
+        self.predicate_labels = meta["predicate_labels"]     # {REL_TYPE: label}
+        self.version = meta.get("version")
+        self.num_terms = len(self.term_lengths)
+        self.num_concepts = len(self.concepts)
+        self.num_relation_pairs = meta["num_relation_pairs"]
+
+    # --- Construction -------------------------------------------------------
+
+    @classmethod
+    def load(cls, path=COMPACT_INDEX_PATH, mmap=True):
+        path = Path(path)
+        with open(path / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format {meta.get('format')} in {path}")
+
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(arrays, meta)
+
+    @classmethod
+    def from_dicts(cls, entity_index, rel_index, predicate_labels, version=None, lazy_closure=False):
+        """Build from the pickle layout: {text: [C_IDs]}, {(C1, C2): {REL_TYPEs}}, {REL_TYPE: label}.
+
+        With lazy_closure the subClassOf closure is only computed on the first hierarchy query.
+        """
+        concept_set = set()
+        for ids in entity_index.values():
+            concept_set.update(ids)
+        for s, t in rel_index:
+            concept_set.add(s)
+            concept_set.add(t)
+        concept_list = sorted(concept_set, key=lambda c: c.encode("utf-8"))
+        concept_pos = {c: i for i, c in enumerate(concept_list)}
+
+        # Term table sorted by (length, bytes) so length buckets are contiguous
+        encoded = sorted(((len(t), t.encode("utf-8"), t, rank) for rank, t in enumerate(entity_index)),
+                         key=lambda x: (x[0], x[1]))
+        term_lengths = np.fromiter((x[0] for x in encoded), dtype=np.int32, count=len(encoded))
+        term_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(x[1]) for x in encoded])
+        term_blob = np.frombuffer(b"".join(x[1] for x in encoded), dtype=np.uint8)
+        term_ranks = np.fromiter((x[3] for x in encoded), dtype=np.int32, count=len(encoded))
+
+        term_ptr = np.zeros(len(encoded) + 1, dtype=np.int64)
+        term_ptr[1:] = np.cumsum([len(entity_index[x[2]]) for x in encoded])
+        term_concepts = np.fromiter(
+            (concept_pos[c] for x in encoded for c in entity_index[x[2]]),
+            dtype=np.int32, count=int(term_ptr[-1])
+        )
+
+        # Relations as (source, target, predicate) triples grouped by source
+        predicates = sorted({p for preds in rel_index.values() for p in preds})
+        pred_pos = {p: i for i, p in enumerate(predicates)}
+        triples = sorted(
+            (concept_pos[s], concept_pos[t], pred_pos[p])
+            for (s, t), preds in rel_index.items() for p in preds
+        )
+        triples = np.array(triples, dtype=np.int32).reshape(-1, 3)
+        rel_ptr = np.zeros(len(concept_list) + 1, dtype=np.int64)
+        rel_ptr[1:] = np.cumsum(np.bincount(triples[:, 0], minlength=len(concept_list)))
+
+        # Incoming edges for backward search, one entry per distinct (source, target) pair
+        pairs = np.unique(triples[:, :2], axis=0) if len(triples) else triples[:, :2]
+        order = np.lexsort((pairs[:, 0], pairs[:, 1]))
+        rev_ptr = np.zeros(len(concept_list) + 1, dtype=np.int64)
+        rev_ptr[1:] = np.cumsum(np.bincount(pairs[:, 1], minlength=len(concept_list)))
+
+        arrays = {
+            "concepts": np.array([c.encode("utf-8") for c in concept_list], dtype=bytes),
+            "term_lengths": term_lengths,
+            "term_offsets": term_offsets,
+            "term_blob": term_blob,
+            "term_ptr": term_ptr,
+            "term_concepts": term_concepts,
+            "term_ranks": term_ranks,
+            "rel_ptr": rel_ptr,
+            "rel_targets": np.ascontiguousarray(triples[:, 1]),
+            "rel_preds": np.ascontiguousarray(triples[:, 2]),
+            "rev_ptr": rev_ptr,
+            "rev_sources": np.ascontiguousarray(pairs[order, 0]),
+            "anc_ptr": None,
+            "anc_ids": None,
+        }
+        meta = {
+            "format": FORMAT_VERSION,
+            "version": version,
+            "num_relation_pairs": len(rel_index),
+            "predicates": predicates,
+            "predicate_labels": {p: predicate_labels[p] for p in predicates if p in predicate_labels},
+        }
+        index = cls(arrays, meta)
+        if not lazy_closure:
+            index.build_closure()
+        return index
+
+    def build_closure(self):
+        """Precompute transitive subClassOf ancestors from the relation arrays."""
+        sources = np.repeat(np.arange(self.num_concepts, dtype=np.int32), np.diff(self.rel_ptr))
+        subclass = self.predicates.index(SUBCLASS_PREDICATE) if SUBCLASS_PREDICATE in self.predicates else -1
+        mask = self.rel_preds == subclass
+        edges = np.stack([sources[mask], self.rel_targets[mask]], axis=1)
+        self.anc_ptr, self.anc_ids = subclass_closure(edges, self.num_concepts)
+
+    def save(self, path=COMPACT_INDEX_PATH):
+        if self.anc_ptr is None:
+            self.build_closure()
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(path / f"{name}.npy", np.asarray(getattr(self, name)))
+        with open(path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2, ensure_ascii=False)
+
+    # --- Concepts -----------------------------------------------------------
+
+    def concept_id(self, idx):
+        return self.concepts[idx].decode("utf-8")
+
+    def concept_index(self, concept_id):
+        """Interned index of a concept ID, or -1 if it is unknown."""
+        key = concept_id.encode("utf-8")
+        idx = int(np.searchsorted(self.concepts, key))
+        if idx < self.num_concepts and self.concepts[idx] == key:
+            return idx
+        return -1
+
+    # --- Terms --------------------------------------------------------------
+
+    def term_bytes(self, i):
+        return self.term_blob[self.term_offsets[i]:self.term_offsets[i + 1]].tobytes()
+
+    def term(self, i):
+        return self.term_bytes(i).decode("utf-8")
+
+    def terms_between(self, start, stop):
+        """Decode the terms [start, stop) of the sorted term table."""
+        base = self.term_offsets[start]
+        blob = self.term_blob[base:self.term_offsets[stop]].tobytes()
+        offsets = (self.term_offsets[start:stop + 1] - base).tolist()
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(stop - start)]
+
+    def length_range(self, lo, hi):
+        """Slice [start, stop) of terms whose length lies within [lo, hi]."""
+        start = int(np.searchsorted(self.term_lengths, lo, side="left"))
+        stop = int(np.searchsorted(self.term_lengths, hi, side="right"))
+        return start, stop
+
+    def find_term(self, text):
+        """Position of an exact term in the table, or -1."""
+        key = text.encode("utf-8")
+        lo, hi = self.length_range(len(text), len(text))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_terms and self.term_lengths[lo] == len(text) and self.term_bytes(lo) == key:
+            return lo
+        return -1
+
+    def term_concept_ids(self, i):
+        return [self.concept_id(c) for c in self.term_concepts[self.term_ptr[i]:self.term_ptr[i + 1]]]
+
+    def lookup_term(self, text):
+        """Concept IDs for an exact (normalized) term, or None if it is not indexed."""
+        i = self.find_term(text)
+        return self.term_concept_ids(i) if i >= 0 else None
+
+    # --- Relations ----------------------------------------------------------
+
+    def relation_slice(self, source_idx, target_idx):
+        """Entry range [start, stop) of relations from source_idx to target_idx."""
+        row_start, row_stop = int(self.rel_ptr[source_idx]), int(self.rel_ptr[source_idx + 1])
+        row = self.rel_targets[row_start:row_stop]
+        start = int(np.searchsorted(row, target_idx, side="left"))
+        stop = int(np.searchsorted(row, target_idx, side="right"))
+        return row_start + start, row_start + stop
+
+    def predicates_between(self, source_id, target_id):
+        """Relation codes recorded from source_id to target_id."""
+        s, t = self.concept_index(source_id), self.concept_index(target_id)
+        if s < 0 or t < 0:
+            return []
+        start, stop = self.relation_slice(s, t)
+        return [self.predicates[p] for p in self.rel_preds[start:stop]]
+
+    def relations_among(self, source_idxs, target_idxs, predicate_idxs=None):
+        """(sources, targets, predicate indexes) of relations from any of source_idxs to any of target_idxs.
+
+        The CSR rows of all sources are gathered into one array and matched against
+        the sorted target_idxs with a single searchsorted; predicate_idxs optionally
+        restricts the predicates.
+        """
+        source_idxs = np.asarray(source_idxs, dtype=np.int64)
+        starts = np.asarray(self.rel_ptr[source_idxs])
+        counts = np.asarray(self.rel_ptr[source_idxs + 1]) - starts
+        total = int(counts.sum())
+        empty = np.zeros(0, dtype=np.int64)
+        if not total or not len(target_idxs):
+            return empty, empty, empty
+
+        entries = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        targets = np.asarray(self.rel_targets[entries])
+        preds = np.asarray(self.rel_preds[entries])
+        pos = np.minimum(np.searchsorted(target_idxs, targets), len(target_idxs) - 1)
+        hit = target_idxs[pos] == targets
+        if predicate_idxs is not None:
+            hit &= np.isin(preds, predicate_idxs)
+        return np.repeat(source_idxs, counts)[hit], targets[hit], preds[hit]
+
+    # --- Paths ----------------------------------------------------------------
+
+    def successors(self, concept_idx):
+        """Distinct targets of outgoing relations (targets repeat once per predicate)."""
+        row = self.rel_targets[self.rel_ptr[concept_idx]:self.rel_ptr[concept_idx + 1]]
+        return np.unique(row) if len(row) > 1 else row
+
+    def predecessors(self, concept_idx):
+        return self.rev_sources[self.rev_ptr[concept_idx]:self.rev_ptr[concept_idx + 1]]
+
+    def shortest_path(self, source_idx, target_idx, max_hops=3, max_expansions=20000,
+                      time_budget=0.05, max_degree=2000):
+        """Bidirectional BFS for a directed path of at most max_hops relations.
+
+        Forward search follows outgoing edges from the source, backward search
+        follows incoming edges into the target, always growing the smaller frontier.
+        Node expansions and wall-clock time are budgeted, and nodes with more than
+        max_degree edges (hubs such as "Neoplasm") are reached but never expanded.
+        Returns (path as concept indexes or None, number of expansions).
+        """
+        if source_idx == target_idx:
+            return [source_idx], 0
+
+        parents = ({source_idx: -1}, {target_idx: -1})      # forward, backward
+        frontiers = ([source_idx], [target_idx])
+        depths = [0, 0]
+        expansions = 0
+        deadline = time.monotonic() + time_budget
+
+        while frontiers[0] and frontiers[1] and depths[0] + depths[1] < max_hops:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            parent, other = parents[side], parents[1 - side]
+            neighbours = self.successors if side == 0 else self.predecessors
+
+            next_frontier = []
+            for node in frontiers[side]:
+                if expansions >= max_expansions or time.monotonic() > deadline:
+                    return None, expansions
+                row = neighbours(node)
+                if len(row) > max_degree and node not in (source_idx, target_idx):
+                    continue
+                expansions += 1
+
+                for nb in row.tolist():
+                    if nb in parent:
+                        continue
+                    parent[nb] = node
+                    if nb in other:
+                        return self._join_path(nb, *parents), expansions
+                    next_frontier.append(nb)
+
+            frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+            depths[side] += 1
+
+        return None, expansions
+
+    @staticmethod
+    def _join_path(meet, forward_parent, backward_parent):
+        path = []
+        node = meet
+        while node != -1:
+            path.append(node)
+            node = forward_parent[node]
+        path.reverse()
+        node = backward_parent[meet]
+        while node != -1:
+            path.append(node)
+            node = backward_parent[node]
+        return path
+
+    # --- Hierarchy (precomputed subClassOf closure) ---------------------------
+
+    def ancestor_indexes(self, concept_idx):
+        if self.anc_ptr is None:
+            self.build_closure()
+        return self.anc_ids[self.anc_ptr[concept_idx]:self.anc_ptr[concept_idx + 1]]
+
+    def ancestors(self, concept_id):
+        """All transitive subClassOf ancestors of a concept (O(1) slice)."""
+        idx = self.concept_index(concept_id)
+        return [] if idx < 0 else [self.concept_id(a) for a in self.ancestor_indexes(idx)]
+
+    def is_ancestor(self, ancestor_id, concept_id):
+        """True if ancestor_id is a (transitive) superclass of concept_id (O(log n))."""
+        a, c = self.concept_index(ancestor_id), self.concept_index(concept_id)
+        if a < 0 or c < 0:
+            return False
+        row = self.ancestor_indexes(c)
+        pos = int(np.searchsorted(row, a))
+        return pos < len(row) and row[pos] == a
+
+    def is_descendant(self, concept_id, ancestor_id):
+        return self.is_ancestor(ancestor_id, concept_id)
+
+
+def load_index(index_path="ncit_indexes.pkl", compact_path=COMPACT_INDEX_PATH):
+    """The memory-mapped compact index if present and current, else one built from the pickle."""
+    if compact_path and (Path(compact_path) / "meta.json").exists():
+        try:
+            return CompactNCItIndex.load(compact_path)
+        except ValueError as e:
+            print(f"⚠ {e}; rebuild it with extra_n/ontology_inspector.py. Falling back to {index_path}")
+
+    with open(index_path, 'rb') as f:
+        data = pickle.load(f)
+    return CompactNCItIndex.from_dicts(
+        data['entity_index'],                        # {normalized_text: [C_IDs]}
+        data['rel_index'],                           # {(C1, C2): [REL_TYPEs]}
+        data.get('predicate_labels', {}),
+        version=data.get('version'),
+        lazy_closure=True
+    )
+
+
+def subclass_closure(edges, num_concepts):
+    """Transitive closure of (child, parent) edges as CSR arrays of sorted ancestor indexes.
+
+    Concepts are processed parents-first so each ancestor set is the union of
+    its parents' sets; any cycle members get whatever their finished parents provide.
+    """
+    parents = [[] for _ in range(num_concepts)]
+    children = [[] for _ in range(num_concepts)]
+    for child, parent in edges.tolist():
+        if child != parent:
+            parents[child].append(parent)
+            children[parent].append(child)
+
+    pending = [len(p) for p in parents]
+    ready = [c for c in range(num_concepts) if not pending[c]]
+    ancestors = [None] * num_concepts
+    empty = np.zeros(0, dtype=np.int32)
+
+    def close(c):
+        parts = [np.array(parents[c], dtype=np.int32)]
+        parts += [ancestors[p] for p in parents[c] if ancestors[p] is not None]
+        ancestors[c] = np.unique(np.concatenate(parts)) if parents[c] else empty
+
+    while ready:
+        c = ready.pop()
+        close(c)
+        for child in children[c]:
+            pending[child] -= 1
+            if not pending[child]:
+                ready.append(child)
+
+    for c in range(num_concepts):
+        if ancestors[c] is None:
+            close(c)
+
+    anc_ptr = np.zeros(num_concepts + 1, dtype=np.int64)
+    anc_ptr[1:] = np.cumsum([len(a) for a in ancestors])
+    anc_ids = np.concatenate(ancestors).astype(np.int32) if num_concepts else empty
+    return anc_ptr, anc_ids
@@ -0,0 +1,163 @@
+# ncit_tagger.py
+
+import re
+import time
+from bisect import bisect_left
+from pathlib import Path
+from ncit_index import COMPACT_INDEX_PATH, load_index
+
+TAGGER_LABEL = "NCIt_concept"
+MIN_TERM_LENGTH = 3        # shorter labels/synonyms are never tagged
+SHORT_TERM_LENGTH = 4      # single-word terms this short must look like acronyms ("ALL", "p53")
+TERM_CHUNK = 50000         # terms decoded at a time when building the token trie
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+DROPPED_TOKENS = set("()[],:;")   # characters the index normalization removes
+
+def normalize_text(text):
+    """Same normalization as the NCIt index (extra_n/ontology_inspector.py)."""
+    text = text.lower()
+    text = re.sub(r'[\(\)\[\],:;]', '', text)
+    text = re.sub(r'\s{2,}', ' ', text)
+    return text.strip()
+
+def looks_like_acronym(text):
+    return text.isupper() or any(ch.isdigit() for ch in text)
+
+def term_keys(text, spans):
+    """Trie keys for the tokens at spans: the lowercased token, prefixed with a
+    space when whitespace separates it from the previous kept token."""
+    keys, previous_end = [], None
+    for start, end in spans:
+        token = text[start:end].lower()
+        gap = previous_end is not None and any(ch.isspace() for ch in text[previous_end:start])
+        keys.append(" " + token if gap else token)
+        previous_end = end
+    return keys
+
+
+class NCItTagger:
+    """Longest-match dictionary tagger over every NCIt label and synonym.
+
+    Every indexed term is split into tokens once, at construction, and inserted
+    into a token trie. A scan walks the trie from each word token, so each
+    position costs at most the length of the longest term sharing its prefix and
+    no term table lookups are needed. Punctuation the index drops (commas,
+    brackets, ...) is skipped, and whitespace between tokens is part of the key,
+    so "breast-cancer" and "breast cancer" stay distinct terms.
+    Tagged entities already carry their concept IDs.
+    """
+
+    def __init__(self, index=None, index_path="ncit_indexes.pkl", compact_path=COMPACT_INDEX_PATH):
+        self.index = index or load_index(index_path, compact_path)
+
+        start = time.perf_counter()
+        self.trie = {}   # {token key: node}; a node's None entry holds the term's table position
+        terms = 0
+        for offset in range(0, self.index.num_terms, TERM_CHUNK):
+            stop = min(offset + TERM_CHUNK, self.index.num_terms)
+            for position, term in enumerate(self.index.terms_between(offset, stop), offset):
+                if len(term) < MIN_TERM_LENGTH:
+                    continue
+                spans = [m.span() for m in TOKEN_RE.finditer(term) if m.group() not in DROPPED_TOKENS]
+                if not spans:
+                    continue
+                node = self.trie
+                for key in term_keys(term, spans):
+                    node = node.setdefault(key, {})
+                node.setdefault(None, position)
+                terms += 1
+        print(f"✅ NCIt tagger ready: {terms} terms ({time.perf_counter() - start:.1f}s)")
+
+    def tag(self, text):
+        """Non-overlapping longest matches as entities, in the extracted_entities.json shape."""
+        spans = [m.span() for m in TOKEN_RE.finditer(text) if m.group() not in DROPPED_TOKENS]
+        keys = term_keys(text, spans)
+        entities = []
+        i = 0
+        while i < len(spans):
+            match = self._longest_match(text, spans, keys, i)
+            if match is None:
+                i += 1
+                continue
+            n, position = match
+            start, end = spans[i][0], spans[i + n - 1][1]
+            entities.append({
+                "label": TAGGER_LABEL,
+                "text": text[start:end],
+                "score": 1.0,
+                "start": start,
+                "end": end,
+                "concept_ids": self.index.term_concept_ids(position)
+            })
+            i += n
+        return entities
+
+    def _longest_match(self, text, spans, keys, i):
+        """(number of tokens, term position) of the longest indexed term starting at token i."""
+        start, end = spans[i]
+        if not (text[start].isalnum() or text[start] == "_"):
+            return None
+        node = self.trie.get(keys[i].lstrip(" "))
+        best = None
+        j = i
+        while node is not None:
+            position = node.get(None)
+            if position is not None:
+                surface = text[start:spans[j][1]]
+                if j > i or len(surface) > SHORT_TERM_LENGTH or looks_like_acronym(surface):
+                    best = (j - i + 1, position)
+            j += 1
+            if j == len(spans):
+                break
+            node = node.get(keys[j])
+        return best
+
+
+def merge_entities(ner_entities, dict_entities):
+    """Combine transformer and dictionary entities, sorted by position.
+
+    A dictionary match on exactly the span of a transformer entity lends it its
+    concept IDs; one overlapping a transformer entity otherwise is dropped; the
+    rest are added as they are.
+    """
+    merged = sorted((dict(e) for e in ner_entities), key=lambda e: e["start"])
+    starts = [e["start"] for e in merged]
+    max_end, reach = [], 0   # running maximum of end offsets, for overlap checks
+    for e in merged:
+        reach = max(reach, e["end"])
+        max_end.append(reach)
+
+    added = []
+    for ent in dict_entities:
+        j = bisect_left(starts, ent["end"]) - 1
+        overlaps = False
+        while j >= 0 and max_end[j] > ent["start"]:
+            other = merged[j]
+            if other["start"] == ent["start"] and other["end"] == ent["end"]:
+                other["concept_ids"] = ent["concept_ids"]
+            if other["end"] > ent["start"]:
+                overlaps = True
+            j -= 1
+        if not overlaps:
+            added.append(ent)
+
+    return sorted(merged + added, key=lambda e: e["start"])
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from collections import Counter
+
+    parser = argparse.ArgumentParser(description="Tag NCIt concepts in cleaned papers by dictionary lookup")
+    parser.add_argument("files", nargs="+", type=Path, help="cleaned .txt files")
+    args = parser.parse_args()
+
+    tagger = NCItTagger()
+    for path in args.files:
+        start = time.perf_counter()
+        entities = tagger.tag(path.read_text(encoding="utf-8"))
+        print(f"⏱ {path.name}: {len(entities)} concepts in {(time.perf_counter() - start) * 1000:.0f} ms")
+        counts = Counter(e["text"].lower() for e in entities)
+        print(json.dumps(counts.most_common(10), ensure_ascii=False))
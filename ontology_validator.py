@@ -1,21 +1,40 @@
 import json
-import pickle
+import math
+import multiprocessing
+import os
+import time
 from collections import defaultdict
+from itertools import product
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from tqdm import tqdm
 from rapidfuzz import process, fuzz
 import re
+from ncit_index import COMPACT_INDEX_PATH, load_index
+
+CLEANED_ENTITIES_NAME = "cleaned_entities.json"   # next to each paper's extracted_relationships.json
+FUZZY_BATCH_SIZE = 64  # queries per cdist call, bounds the score matrix size
+
+# Multi-hop path search budgets
+PATH_MAX_HOPS = 3
+PATH_MAX_EXPANSIONS = 20000     # per source/target ID pair
+PATH_TIME_BUDGET = 0.05         # seconds per relationship, shared by all its ID pairs
+PATH_PAPER_TIME_BUDGET = 2.0    # seconds per paper
+PATH_MAX_DEGREE = 2000          # nodes with more edges are never expanded
 
 class NCItValidator:
-    def __init__(self, index_path="ncit_indexes.pkl"):
-        with open(index_path, 'rb') as f:
-            data = pickle.load(f)
+    def __init__(self, index_path="ncit_indexes.pkl", compact_path=COMPACT_INDEX_PATH):
+        # Prefer the memory-mapped compact index; fall back to the pickle
+        self.index = load_index(index_path, compact_path)
 
-        self.entity_index = data['entity_index']             # {normalized_text: [C_IDs]}
-        self.rel_index = data['rel_index']                   # {(C1, C2): [REL_TYPEs]}
-        self.predicate_labels = data.get('predicate_labels', {})
-        self.term_list = list(self.entity_index.keys())
+        self.predicate_labels = self.index.predicate_labels
+        self.predicate_labels_lower = {code: label.lower() for code, label in self.predicate_labels.items()}
+        self._resolve_cache = {}                             # {(normalized_text, fuzzy, threshold): [C_IDs]}
+        self._requested_predicates = {}                      # {requested relation: predicate indexes}
+        self.fuzzy_workers = -1                              # cdist threads; 1 inside a process pool
 
-        print(f"✅ Loaded {len(self.entity_index)} entities and {len(self.rel_index)} relationships")
+        print(f"✅ Loaded {self.index.num_terms} entities and {self.index.num_relation_pairs} relationships")
 
     def normalize(self, term):
         """Lowercase and strip unwanted characters."""
@@ -26,52 +45,219 @@ class NCItValidator:
 
     def resolve_entity(self, term, fuzzy=True, threshold=85):
         """Resolve a term to NCIt concept IDs using exact or fuzzy match."""
-        norm_term = self.normalize(term)
+        return self.resolve_entities([term], fuzzy=fuzzy, threshold=threshold)[term]
+
+    def resolve_entities(self, terms, fuzzy=True, threshold=85, known_ids=None):
+        """Resolve many terms at once: {term: [C_IDs]}.
+
+        Terms are normalized and deduplicated, results are memoized across calls,
+        and fuzzy fallbacks are scored in batches against length-blocked candidates.
+        known_ids ({normalized_text: [C_IDs]}, see load_known_ids) are used as they
+        are, without any lookup.
+        """
+        resolved = {}
+        pending = defaultdict(list)   # {normalized_text: [original terms]}
 
-        # Exact match
-        if norm_term in self.entity_index:
-            return self.entity_index[norm_term]
+        for term in terms:
+            if term in resolved:
+                continue
+            norm_term = self.normalize(term)
+            if known_ids and known_ids.get(norm_term):
+                resolved[term] = known_ids[norm_term]
+                continue
+            key = (norm_term, fuzzy, threshold)
+
+            if key in self._resolve_cache:
+                resolved[term] = self._resolve_cache[key]
+                continue
+
+            # Exact match
+            ids = self.index.lookup_term(norm_term)
+            if ids is not None:
+                resolved[term] = self._resolve_cache[key] = ids
+            elif fuzzy:
+                pending[norm_term].append(term)
+            else:
+                resolved[term] = self._resolve_cache[key] = []
 
         # Fuzzy match fallback
-        if fuzzy:
-            matches = process.extract(norm_term, self.term_list, scorer=fuzz.ratio, limit=1)
-            if matches and matches[0][1] >= threshold:
-                best_match = matches[0][0]
-                return self.entity_index[best_match]
+        if pending:
+            matches = self._fuzzy_match_batch(list(pending), threshold)
+            for norm_term, originals in pending.items():
+                ids = matches.get(norm_term, [])
+                self._resolve_cache[(norm_term, fuzzy, threshold)] = ids
+                for term in originals:
+                    resolved[term] = ids
+
+        return resolved
+
+    @staticmethod
+    def length_window(length, threshold):
+        """Candidate lengths that can still reach `threshold` with fuzz.ratio.
+
+        ratio <= 200 * min(a, b) / (a + b), so any term outside this window scores
+        below the threshold and can be skipped without changing the best match.
+        """
+        lo = math.ceil(length * threshold / (200 - threshold) - 1e-9)
+        hi = math.floor(length * (200 - threshold) / threshold + 1e-9)
+        return lo, hi
+
+    def _fuzzy_match_batch(self, norm_terms, threshold):
+        """Best fuzz.ratio match (>= threshold) for each term.
+
+        Ties go to the term that comes first in the original entity_index order,
+        as with process.extract over the full term list.
+        """
+        by_length = defaultdict(list)
+        for norm_term in norm_terms:
+            if norm_term:
+                by_length[len(norm_term)].append(norm_term)
+
+        matches = {}
+        for length, queries in by_length.items():
+            lo, hi = self.length_window(length, threshold)
+            start, stop = self.index.length_range(lo, hi)
+            if start == stop:
+                continue
+            candidates = self.index.terms_between(start, stop)
+            ranks = np.asarray(self.index.term_ranks[start:stop])
+
+            for offset in range(0, len(queries), FUZZY_BATCH_SIZE):
+                batch = queries[offset:offset + FUZZY_BATCH_SIZE]
+                scores = process.cdist(
+                    batch, candidates,
+                    scorer=fuzz.ratio, processor=None,
+                    score_cutoff=threshold, dtype=np.float64, workers=self.fuzzy_workers
+                )
+                best = scores.max(axis=1)
+                for row, norm_term in enumerate(batch):
+                    if best[row] < threshold:
+                        continue
+                    tied = np.flatnonzero(scores[row] == best[row])
+                    col = tied[ranks[tied].argmin()]
+                    matches[norm_term] = self.index.term_concept_ids(start + col)
 
-        return []
+        return matches
+
+    def load_known_ids(self, entities_path):
+        """{normalized_text: [C_IDs]} for the dictionary-tagged entities of a cleaned_entities.json file."""
+        try:
+            with open(entities_path, encoding='utf-8') as f:
+                entities = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return {self.normalize(e['text']): e['concept_ids'] for e in entities if e.get('concept_ids')}
 
     def find_relationships(self, source_id, target_id, requested_relation=None):
         relationships = []
         requested_relation = requested_relation.lower() if requested_relation else None
 
-        for (s, t), preds in self.rel_index.items():
-            if s == source_id and t == target_id:
-                for pred in preds:
-                    pred_label = self.predicate_labels.get(pred, "").lower()
-                    is_requested = (
-                        requested_relation
-                        and (requested_relation == pred.lower() or requested_relation in pred_label)
-                    )
-                    relationships.append({
-                        "code": pred,
-                        "label": self.predicate_labels.get(pred, ""),
-                        "is_requested_relation": is_requested
-                    })
+        for pred in self.index.predicates_between(source_id, target_id):
+            pred_label = self.predicate_labels_lower.get(pred, "")
+            is_requested = (
+                requested_relation
+                and (requested_relation == pred.lower() or requested_relation in pred_label)
+            )
+            relationships.append({
+                "code": pred,
+                "label": self.predicate_labels.get(pred, ""),
+                "is_requested_relation": is_requested
+            })
 
         return relationships
 
+    def find_ancestor_relationships(self, source_id, target_id, requested_relation):
+        """Requested relation held by an ancestor of the source and/or target.
 
-def validate(input_path, output_path):
-    validator = NCItValidator()
+        Uses the precomputed subClassOf closure, so no graph walk happens here:
+        the relation rows of the source and its ancestors are gathered at once and
+        matched against the target plus its ancestors, keeping only predicates
+        that match the requested relation.
+        """
+        requested_relation = requested_relation.lower() if requested_relation else None
+        s, t = self.index.concept_index(source_id), self.index.concept_index(target_id)
+        if not requested_relation or s < 0 or t < 0:
+            return []
+        predicate_idxs = self.requested_predicates(requested_relation)
+        if not len(predicate_idxs):
+            return []
 
-    with open(input_path, encoding='utf-8') as f:
-        extractions = json.load(f)
+        source_chain = np.append(s, self.index.ancestor_indexes(s))
+        target_chain = np.unique(np.append(self.index.ancestor_indexes(t), t))
+        sources, targets, preds = self.index.relations_among(source_chain, target_chain, predicate_idxs)
+
+        relationships = []
+        for sa, ta, p in zip(sources.tolist(), targets.tolist(), preds.tolist()):
+            if sa == s and ta == t:
+                continue  # direct edge, reported by find_relationships
+            pred = self.index.predicates[p]
+            relationships.append({
+                "source_ancestor_id": self.index.concept_id(sa),
+                "target_ancestor_id": self.index.concept_id(ta),
+                "code": pred,
+                "label": self.predicate_labels.get(pred, ""),
+                "is_requested_relation": True,
+                "match": "ancestor"
+            })
+
+        return relationships
+
+    def requested_predicates(self, requested_relation):
+        """Sorted predicate indexes whose code or label matches a (lowercased) requested relation."""
+        if requested_relation not in self._requested_predicates:
+            self._requested_predicates[requested_relation] = np.array([
+                i for i, pred in enumerate(self.index.predicates)
+                if requested_relation == pred.lower() or requested_relation in self.predicate_labels_lower.get(pred, "")
+            ], dtype=np.int64)
+        return self._requested_predicates[requested_relation]
+
+    def find_path(self, source_id, target_id, max_hops=PATH_MAX_HOPS, time_budget=PATH_TIME_BUDGET):
+        """Shortest explanatory relation path (<= max_hops) from source to target, or None."""
+        s, t = self.index.concept_index(source_id), self.index.concept_index(target_id)
+        if s < 0 or t < 0 or s == t:
+            return None
+
+        path, _ = self.index.shortest_path(
+            s, t, max_hops=max_hops, max_expansions=PATH_MAX_EXPANSIONS,
+            time_budget=time_budget, max_degree=PATH_MAX_DEGREE
+        )
+        if not path:
+            return None
+
+        hops = []
+        for a, b in zip(path, path[1:]):
+            a_id, b_id = self.index.concept_id(a), self.index.concept_id(b)
+            codes = self.index.predicates_between(a_id, b_id)
+            hops.append({
+                "source_id": a_id,
+                "target_id": b_id,
+                "codes": codes,
+                "labels": [self.predicate_labels.get(code, "") for code in codes]
+            })
+        return {"match": "path", "hops": len(hops), "path": hops}
+
+
+def validate_relationships(validator, extractions, progress=True, find_paths=True, known_ids=None):
+    """Check extracted {source, relation, target} triples against the NCIt index.
+
+    Entities the NCIt tagger already identified (known_ids) skip exact and fuzzy resolution.
+
+    Without any direct or ancestor relation, bounded multi-hop paths between the
+    resolved concepts are attached as explanations (find_paths). Path search gets
+    PATH_TIME_BUDGET per relationship across all its ID pairs and
+    PATH_PAPER_TIME_BUDGET for the whole call.
+    """
+    paper_deadline = time.monotonic() + PATH_PAPER_TIME_BUDGET
+    # Resolve every distinct entity string of the paper in one batch
+    resolved = validator.resolve_entities(
+        [rel['source'] for rel in extractions] + [rel['target'] for rel in extractions],
+        known_ids=known_ids
+    )
 
     results = []
-    for rel in tqdm(extractions, desc="Validating"):
-        source_ids = validator.resolve_entity(rel['source'])
-        target_ids = validator.resolve_entity(rel['target'])
+    for rel in tqdm(extractions, desc="Validating", disable=not progress):
+        source_ids = resolved[rel['source']]
+        target_ids = resolved[rel['target']]
 
         result = {
             "source": rel['source'],
@@ -81,6 +267,7 @@ def validate(input_path, output_path):
             "target_ids": target_ids,
             "valid_entities": bool(source_ids and target_ids),
             "requested_relation_found": False,
+            "requested_relation_found_via_ancestor": False,
             "all_relationships": []
         }
 
@@ -97,14 +284,103 @@ def validate(input_path, output_path):
                         if any(r['is_requested_relation'] for r in rels):
                             result['requested_relation_found'] = True
 
+            # Valid via ancestor: the edge is recorded on a superclass of either side
+            if not result['requested_relation_found']:
+                for sid in source_ids:
+                    for tid in target_ids:
+                        rels = validator.find_ancestor_relationships(sid, tid, rel['relation'])
+                        if rels:
+                            result['all_relationships'].extend([{
+                                "source_id": sid,
+                                "target_id": tid,
+                                **r
+                            } for r in rels])
+                            result['requested_relation_found_via_ancestor'] = True
+
+            # No relation at all: look for short explanatory paths
+            if find_paths and not result['all_relationships']:
+                deadline = min(time.monotonic() + PATH_TIME_BUDGET, paper_deadline)
+                for sid, tid in product(source_ids, target_ids):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    path = validator.find_path(sid, tid, time_budget=remaining)
+                    if path:
+                        result['all_relationships'].append({
+                            "source_id": sid,
+                            "target_id": tid,
+                            **path
+                        })
+
         results.append(result)
 
+    return results
+
+
+def validate(input_path, output_path, validator=None, progress=True):
+    validator = validator or NCItValidator()
+
+    with open(input_path, encoding='utf-8') as f:
+        extractions = json.load(f)
+
+    known_ids = validator.load_known_ids(Path(input_path).with_name(CLEANED_ENTITIES_NAME))
+    results = validate_relationships(validator, extractions, progress=progress, known_ids=known_ids)
+
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
 
     print(f"✅ Saved validation output to {output_path}")
 
 
+# === Corpus validation ===
+# Loaded once in the parent; forked workers inherit it copy-on-write
+# (the compact index is memory-mapped, so its pages are shared either way).
+_shared_validator = None
+
+def _init_validation_worker(index_path, compact_path):
+    global _shared_validator
+    if _shared_validator is None:   # spawn start method: load in the worker
+        _shared_validator = NCItValidator(index_path, compact_path)
+    _shared_validator.fuzzy_workers = 1
+
+def _validate_paper(input_path, output_path):
+    validate(input_path, output_path, validator=_shared_validator, progress=False)
+    return output_path
+
+def validate_corpus(jobs, workers=None, index_path="ncit_indexes.pkl", compact_path=COMPACT_INDEX_PATH):
+    """Validate many papers, [(input_path, output_path)], with one loaded index.
+
+    Papers are spread across a process pool and each validated_relationships.json
+    is written as soon as its paper finishes.
+    """
+    global _shared_validator
+    jobs = [(str(i), str(o)) for i, o in jobs]
+    if not jobs:
+        return
+
+    _shared_validator = NCItValidator(index_path, compact_path)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+
+    if workers == 1:
+        for input_path, output_path in tqdm(jobs, desc="Validating papers"):
+            validate(input_path, output_path, validator=_shared_validator, progress=False)
+        return
+
+    # The pickle fallback builds the subClassOf closure lazily; build it before
+    # forking so workers share it instead of each rebuilding their own copy
+    if _shared_validator.index.anc_ptr is None:
+        _shared_validator.index.build_closure()
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_validation_worker,
+                             initargs=(index_path, compact_path)) as pool:
+        futures = [pool.submit(_validate_paper, i, o) for i, o in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Validating papers"):
+            future.result()
+
+
 if __name__ == "__main__":
     validate(
         input_path="./output/extracted_relationships.json",
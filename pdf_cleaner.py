@@ -1,61 +1,204 @@
 import os
 import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import fitz  # PyMuPDF
+import tiktoken
 
 # Paths
 PDF_FOLDER = "./dataset/research_papers/"
 CLEANED_FOLDER = "./dataset/cleaned_papers/"
 
+# Cleaning patterns, compiled once per process
+URL_PATTERN = re.compile(r"http[s]?://\S+")
+REFERENCE_NUMBER_PATTERN = re.compile(r"\[[0-9]+\]")
+DIGITS_PATTERN = re.compile(r"\d+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# The whole line must be the heading (optionally numbered), so sentences that merely start with it are kept
+REFERENCES_HEADING = re.compile(
+    r"(?:[0-9IVX]+\.?\s*)?(references|bibliography|literature cited|works cited|references and notes)\s*:?", re.I)
+AFTER_REFERENCES = re.compile(r"^(fig(ure)?\.?\s*\d+|table\s+\d+|appendix|supplementary)", re.I)
+
+# Layout-aware cleaning
+MARGIN_ZONE = 0.12            # top/bottom fraction of the page where headers and footers live
+MARGIN_REPEAT_RATIO = 0.3     # margin blocks on at least this share of pages are dropped (alternating headers)
+PAGE_REPEAT_RATIO = 0.6       # blocks anywhere on the page repeated this often are dropped (side banners)
+MIN_REPEAT_PAGES = 2
+REFERENCES_MIN_POSITION = 0.33   # a references heading before this share of the text is ignored
+TOKEN_MODEL = "gpt-4o"           # tokenizer used to report tokens saved
+
+_encoding = None
+
 def clean_text(text):
     """Cleans extracted text by removing references, links, and unnecessary sections"""
-    text = re.sub(r"http[s]?://\S+", "", text)  # Remove URLs
-    text = re.sub(r"\[[0-9]+\]", "", text)      # Remove reference numbers like [1]
+    text = URL_PATTERN.sub("", text)              # Remove URLs
+    text = REFERENCE_NUMBER_PATTERN.sub("", text)  # Remove reference numbers like [1]
     return text
 
-def extract_text_pymupdf(pdf_path):
-    """Extract text from PDF using PyMuPDF (block-sorted for column awareness)"""
-    doc = fitz.open(pdf_path)
-    all_text = ""
-
-    for page in doc:
-        blocks = page.get_text("blocks")  # returns: (x0, y0, x1, y1, "text", block_no, ...)
-        sorted_blocks = sorted(blocks, key=lambda b: (b[1], b[0]))  # sort by Y, then X
-        for block in sorted_blocks:
-            text = block[4].strip()
-            if text:
-                all_text += text + "\n"
-    
-    return all_text
+def count_tokens(text):
+    """Tokens in text for the LLM tokenizer (about 4 characters each when it is unavailable)"""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(TOKEN_MODEL)
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable ({e.__class__.__name__}); estimating tokens as chars / 4")
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+def page_blocks(page):
+    """Non-empty (y0, y1, text) blocks of one page, sorted by Y, then X"""
+    blocks = page.get_text("blocks")  # returns: (x0, y0, x1, y1, "text", block_no, ...)
+    sorted_blocks = sorted(blocks, key=lambda b: (b[1], b[0]))
+    return [(b[1], b[3], b[4].strip()) for b in sorted_blocks if b[4].strip()]
+
+def block_key(text):
+    """Block text with digits and spacing normalized, so 'Page 3' and 'Page 4' compare equal"""
+    return WHITESPACE_PATTERN.sub(" ", DIGITS_PATTERN.sub("#", text.lower())).strip()
+
+def repeated_block_keys(pages):
+    """Keys of running headers, footers, page numbers and banners.
+
+    pages: [(page height, [(y0, y1, text)])]. A block counts as repeated when the
+    same key appears in the top/bottom margin of many pages, or anywhere on most pages.
+    """
+    margin_counts, page_counts = Counter(), Counter()
+    for height, blocks in pages:
+        margin_keys, page_keys = set(), set()
+        for y0, y1, text in blocks:
+            key = block_key(text)
+            page_keys.add(key)
+            if y1 <= height * MARGIN_ZONE or y0 >= height * (1 - MARGIN_ZONE):
+                margin_keys.add(key)
+        margin_counts.update(margin_keys)
+        page_counts.update(page_keys)
+
+    n_pages = len(pages)
+    margin_min = max(MIN_REPEAT_PAGES, MARGIN_REPEAT_RATIO * n_pages)
+    page_min = max(MIN_REPEAT_PAGES, PAGE_REPEAT_RATIO * n_pages)
+    repeated = {key for key, count in margin_counts.items() if count >= margin_min}
+    repeated.update(key for key, count in page_counts.items() if count >= page_min)
+    return repeated
+
+def references_range(texts):
+    """[start, stop) of the trailing bibliography in a list of block texts, or None.
+
+    Starts at the last references heading in the body and runs to the end, or
+    to the first figure/table caption or appendix that follows it.
+    """
+    start = None
+    for i, text in enumerate(texts):
+        if REFERENCES_HEADING.fullmatch(text.split("\n", 1)[0].strip()) and i >= len(texts) * REFERENCES_MIN_POSITION:
+            start = i
+    if start is None:
+        return None
+
+    for stop in range(start + 1, len(texts)):
+        if AFTER_REFERENCES.match(texts[stop]):
+            return start, stop
+    return start, len(texts)
 
 def extract_and_clean_pdf(pdf_path, output_path):
-    """Extracts and cleans text from a PDF using PyMuPDF"""
+    """Extracts and cleans text from a PDF, dropping repeated page furniture and the references.
+
+    The cleaning patterns never span a line, so blocks are cleaned and written one
+    at a time. Returns a stats dict: timings, characters and tokens before/after.
+    """
+    start = time.perf_counter()
+    stats = {"pdf": pdf_path, "seconds": 0.0, "chars_before": 0, "chars_after": 0,
+             "tokens_before": 0, "tokens_after": 0, "repeated_blocks": 0, "reference_blocks": 0, "error": None}
     try:
-        raw_text = extract_text_pymupdf(pdf_path)
-        cleaned_text = clean_text(raw_text)
+        with fitz.open(pdf_path) as doc:
+            pages = [(page.rect.height, page_blocks(page)) for page in doc]
+
+        repeated = repeated_block_keys(pages)
+        texts = []
+        for _, blocks in pages:
+            for _, _, text in blocks:
+                stats["chars_before"] += len(text) + 1
+                stats["tokens_before"] += count_tokens(text + "\n")
+                if block_key(text) in repeated:
+                    stats["repeated_blocks"] += 1
+                else:
+                    texts.append(text)
+
+        references = references_range(texts)
+        if references:
+            ref_start, ref_stop = references
+            stats["reference_blocks"] = ref_stop - ref_start
+            texts = texts[:ref_start] + texts[ref_stop:]
 
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         with open(output_path, "w", encoding="utf-8") as f:
-            f.write(cleaned_text)
+            for text in texts:
+                cleaned = clean_text(text + "\n")
+                f.write(cleaned)
+                stats["chars_after"] += len(cleaned)
+                stats["tokens_after"] += count_tokens(cleaned)
 
-        print(f"✅ Cleaned text saved to {output_path}")
-    
     except Exception as e:
-        print(f"⚠️ Error processing {pdf_path}: {e}")
+        stats["error"] = str(e)
 
-def process_all_pdfs(pdf_folder, cleaned_folder):
-    """Processes all PDFs in the research papers folder"""
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+def process_all_pdfs(pdf_folder, cleaned_folder, workers=None):
+    """Processes all PDFs in the research papers folder across a process pool"""
     if not os.path.exists(cleaned_folder):
         os.makedirs(cleaned_folder)
-    
-    pdf_files = [f for f in os.listdir(pdf_folder) if f.endswith(".pdf")]
+
+    pdf_files = sorted(f for f in os.listdir(pdf_folder) if f.endswith(".pdf"))
     if not pdf_files:
         print("❌ No PDFs found in the folder.")
         return
-    
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(pdf_folder, pdf_file)
-        cleaned_text_path = os.path.join(cleaned_folder, f"{os.path.splitext(pdf_file)[0]}.txt")
-        extract_and_clean_pdf(pdf_path, cleaned_text_path)
+
+    jobs = [
+        (os.path.join(pdf_folder, pdf_file), os.path.join(cleaned_folder, f"{os.path.splitext(pdf_file)[0]}.txt"))
+        for pdf_file in pdf_files
+    ]
+    return process_pdfs(jobs, workers)
+
+def process_pdfs(jobs, workers=None):
+    """Extract and clean [(pdf_path, output_path)] across a process pool; returns each file's stats"""
+    if not jobs:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+
+    start = time.perf_counter()
+    if workers == 1:
+        results = report_results(extract_and_clean_pdf(pdf_path, output_path) for pdf_path, output_path in jobs)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(extract_and_clean_pdf, pdf_path, output_path) for pdf_path, output_path in jobs]
+            results = report_results(future.result() for future in as_completed(futures))
+
+    totals = Counter()
+    for stats in results:
+        if not stats["error"]:
+            totals.update({key: stats[key] for key in ("chars_before", "chars_after", "tokens_before", "tokens_after")})
+    print(f"⏱ Cleaned {len(jobs)} PDFs in {time.perf_counter() - start:.1f}s with {workers} worker(s)")
+    print(f"✂️ Saved {totals['chars_before'] - totals['chars_after']} chars and "
+          f"{totals['tokens_before'] - totals['tokens_after']} tokens in total")
+    return results
+
+def report_results(results):
+    """Print per-file timings and savings as files finish; returns the stats"""
+    finished = []
+    for stats in results:
+        finished.append(stats)
+        if stats["error"]:
+            print(f"⚠️ Error processing {stats['pdf']}: {stats['error']}")
+            continue
+        saved_chars = stats["chars_before"] - stats["chars_after"]
+        saved_tokens = stats["tokens_before"] - stats["tokens_after"]
+        share = saved_tokens / stats["tokens_before"] if stats["tokens_before"] else 0.0
+        print(f"✅ {os.path.basename(stats['pdf'])}: {stats['chars_after']} chars in {stats['seconds']:.2f}s, "
+              f"saved {saved_chars} chars / {saved_tokens} tokens ({share:.0%}; "
+              f"{stats['repeated_blocks']} repeated blocks, {stats['reference_blocks']} reference blocks)")
+    return finished
 
 if __name__ == "__main__":
     process_all_pdfs(PDF_FOLDER, CLEANED_FOLDER)
@@ -0,0 +1,117 @@
+# pipeline_manifest.py
+
+import hashlib
+import importlib.util
+import json
+import os
+from pathlib import Path
+
+MANIFEST_PATH = Path("./output/pipeline_manifest.json")
+SAVE_EVERY = 20          # records between intermediate saves, so a crash loses little work
+HASH_CHUNK = 1 << 20
+
+
+def sha256_parts(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+def code_version(*module_names):
+    """Hash of the source files of the given modules, so editing a stage invalidates its results."""
+    h = hashlib.sha256()
+    for name in module_names:
+        spec = importlib.util.find_spec(name)
+        if spec is None or not spec.origin or not os.path.exists(spec.origin):
+            h.update(name.encode("utf-8"))
+            continue
+        with open(spec.origin, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+def index_version(index_path="ncit_indexes.pkl", compact_path="ncit_index"):
+    """Identity of the NCIt index the validator will load, without loading it."""
+    meta_path = Path(compact_path) / "meta.json"
+    if meta_path.exists():
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        return {"version": meta.get("version"), "format": meta.get("format"),
+                "meta": hashlib.sha256(meta_path.read_bytes()).hexdigest()[:16]}
+    if os.path.exists(index_path):
+        stat = os.stat(index_path)
+        return {"pickle_size": stat.st_size, "pickle_mtime": stat.st_mtime_ns}
+    return None
+
+
+class PipelineManifest:
+    """Per-paper, per-stage fingerprints of what each stage last produced.
+
+    A fingerprint hashes the stage's code/config version with the contents of
+    its input files, so a stage is skipped while its inputs and code are unchanged,
+    and a changed artifact only invalidates the stages that read it.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = Path(path)
+        self.data = {"papers": {}, "files": {}}
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"⚠ Could not read {self.path} ({e}); every stage will run")
+        self.pending = 0
+        self.skipped = {}   # {stage: papers skipped this run}
+
+    def file_hash(self, path):
+        """Content hash of a file, memoized on (size, mtime) so unchanged files are not re-read."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        stat = path.stat()
+        known = self.data["files"].get(str(path))
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.data["files"][str(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def fingerprint(self, inputs, version, config=None):
+        """Fingerprint of a stage run over the given input files."""
+        return sha256_parts(version, config, [self.file_hash(p) for p in inputs])
+
+    def is_current(self, paper, stage, fingerprint, outputs):
+        """True if the stage already ran on these inputs and its outputs are still there."""
+        entry = self.data["papers"].get(paper, {}).get(stage)
+        if not entry or entry["fingerprint"] != fingerprint:
+            return False
+        if not all(Path(p).exists() for p in outputs):
+            return False
+        self.skipped[stage] = self.skipped.get(stage, 0) + 1
+        return True
+
+    def record(self, paper, stage, fingerprint):
+        self.data["papers"].setdefault(paper, {})[stage] = {"fingerprint": fingerprint}
+        self.pending += 1
+        if self.pending >= SAVE_EVERY:
+            self.save()
+
+    def report(self, stage, total):
+        skipped = self.skipped.get(stage, 0)
+        if skipped:
+            print(f"⏭ {stage}: {skipped}/{total} papers unchanged, skipped")
+
+    def save(self):
+        """Write the manifest atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+        self.pending = 0
@@ -0,0 +1,166 @@
+# prompt_budget.py
+
+import json
+import math
+import os
+from llm_provider import get_encoding
+
+# Prompt tokens for one relationship-extraction request: instructions + entity list + text
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "24000"))
+ENTITY_BUDGET_SHARE = 0.1     # entity list share guaranteed when the paper does not fit
+SECTION_TOKENS = 400          # text is selected in sections of about this many tokens
+SECTION_GAP = "\n[...]\n"     # marks text left out between selected sections
+DEFAULT_NER_SCORE = 0.85      # entities without a score (dictionary matches, plain lists)
+
+# Weights of the entity ranking
+MENTION_WEIGHT = 0.5
+PROXIMITY_WEIGHT = 0.3
+SCORE_WEIGHT = 0.2
+
+
+def load_entity_scores(cleaned_path):
+    """{entity text (lowercase): best NER score} from a cleaned_entities.json file, or {} if missing."""
+    try:
+        with open(cleaned_path, "r", encoding="utf-8") as f:
+            cleaned = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    scores = {}
+    for entity in cleaned:
+        key = entity.get("text", "").lower()
+        scores[key] = max(scores.get(key, 0.0), float(entity.get("score", 0.0)))
+    return scores
+
+def count_tokens(text, model_name="gpt-4o"):
+    return len(get_encoding(model_name).encode(text, disallowed_special=()))
+
+def split_sections(text, max_tokens=SECTION_TOKENS, model_name="gpt-4o"):
+    """[(section text, tokens)] at line boundaries; a line longer than max_tokens is its own section."""
+    enc = get_encoding(model_name)
+    sections, current, current_tokens = [], [], 0
+    for line in text.splitlines(keepends=True):
+        n = len(enc.encode(line, disallowed_special=()))
+        if current and current_tokens + n > max_tokens:
+            sections.append(("".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += n
+    if current:
+        sections.append(("".join(current), current_tokens))
+    return [(section, n) for section, n in sections if section.strip()]
+
+def rank_entities(entities, sections, core_entity, entity_scores=None):
+    """Entities with their ranking features, best first.
+
+    An entity ranks higher the more often it is mentioned, the larger the share of
+    its mentions that fall in or next to a section naming the core entity, and the
+    higher its NER score.
+    """
+    entity_scores = entity_scores or {}
+    lowered = [section.lower() for section, _ in sections]
+    core = core_entity.lower()
+    near_core = set()
+    for i, section in enumerate(lowered):
+        if core and core in section:
+            near_core.update((i - 1, i, i + 1))
+
+    ranked = []
+    for entity in entities:
+        key = entity.lower()
+        counts = [section.count(key) for section in lowered] if key else []
+        mentions = sum(counts)
+        near = sum(count for i, count in enumerate(counts) if i in near_core)
+        ranked.append({
+            "entity": entity,
+            "mentions": mentions,
+            "proximity": near / mentions if mentions else 0.0,
+            "ner_score": entity_scores.get(key, DEFAULT_NER_SCORE),
+            "sections": [i for i, count in enumerate(counts) if count],
+        })
+
+    max_mentions = max((r["mentions"] for r in ranked), default=0)
+    for r in ranked:
+        frequency = math.log1p(r["mentions"]) / math.log1p(max_mentions) if max_mentions else 0.0
+        r["rank_score"] = (MENTION_WEIGHT * frequency + PROXIMITY_WEIGHT * r["proximity"]
+                           + SCORE_WEIGHT * r["ner_score"])
+    ranked.sort(key=lambda r: (r["mentions"] > 0, r["rank_score"]), reverse=True)
+    return ranked
+
+def plan_prompt(text, entities, core_entity, entity_scores=None, budget=PROMPT_TOKEN_BUDGET, overhead=0):
+    """Fit the entity list and paper text of one prompt into a token budget.
+
+    overhead is the token count of the rest of the prompt (instructions, example).
+    Every entity is kept when text and entities fit together. Otherwise the
+    best-ranked entities get whatever the whole text leaves, but at least
+    ENTITY_BUDGET_SHARE of the budget, and the sections mentioning the most (and
+    best) kept entities fill what is left, in document order. Returns (text,
+    entities, report).
+    """
+    sections = split_sections(text)
+    text_tokens = sum(n for _, n in sections)
+    ranked = rank_entities(entities, sections, core_entity, entity_scores)
+    available = max(budget - overhead, 0)
+
+    # Entity list: json.dumps adds quotes and a ", " separator per entity.
+    # The ENTITY_BUDGET_SHARE cap only applies when text and entities do not fit together.
+    sizes = [count_tokens(json.dumps(r["entity"])) + 1 for r in ranked]
+    if text_tokens + 2 + sum(sizes) <= available:
+        entity_budget = available
+    else:
+        entity_budget = min(max(int(budget * ENTITY_BUDGET_SHARE), available - text_tokens), available)
+    kept, entity_tokens = [], 2
+    for r, n in zip(ranked, sizes):
+        if entity_tokens + n > entity_budget:
+            break
+        kept.append(r)
+        entity_tokens += n
+
+    text_budget = max(available - entity_tokens, 0)
+    if text_tokens <= text_budget:
+        chosen = list(range(len(sections)))
+        selected_text = text
+    else:
+        section_scores = [0.0] * len(sections)
+        for r in kept:
+            for i in r["sections"]:
+                section_scores[i] += r["rank_score"]
+        gap_tokens = count_tokens(SECTION_GAP)
+        chosen, used = [], 0
+        order = sorted(range(len(sections)), key=lambda i: (section_scores[i], -i), reverse=True)
+        for i in order:
+            n = sections[i][1] + gap_tokens
+            if used + n <= text_budget:
+                chosen.append(i)
+                used += n
+        chosen.sort()
+        selected_text = join_sections(sections, chosen)
+
+    report = {
+        "budget": budget,
+        "overhead_tokens": overhead,
+        "entity_tokens": entity_tokens,
+        "text_tokens": sum(sections[i][1] for i in chosen),
+        "entities_kept": len(kept),
+        "entities_total": len(entities),
+        "sections_kept": len(chosen),
+        "sections_total": len(sections),
+        "text_tokens_total": text_tokens,
+    }
+    report["unused_tokens"] = budget - overhead - entity_tokens - report["text_tokens"]
+    return selected_text, [r["entity"] for r in kept], report
+
+def join_sections(sections, chosen):
+    """Text of the chosen sections in order, with SECTION_GAP wherever text was left out."""
+    pieces, previous = [], -1
+    for i in chosen:
+        if i != previous + 1:
+            pieces.append(SECTION_GAP.lstrip("\n") if previous < 0 else SECTION_GAP)
+        pieces.append(sections[i][0])
+        previous = i
+    return "".join(pieces)
+
+def format_report(report):
+    return (f"💰 Prompt budget {report['budget']}: {report['overhead_tokens']} instructions, "
+            f"{report['entity_tokens']} entities ({report['entities_kept']}/{report['entities_total']}), "
+            f"{report['text_tokens']} text ({report['sections_kept']}/{report['sections_total']} sections, "
+            f"{report['text_tokens_total']} in paper), {report['unused_tokens']} unused")
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class ResultCache:
+    """Persistent content-addressed cache of JSON results in SQLite.
+
+    Entries are keyed by a hash of their inputs and evicted least-recently-used
+    first once the stored values exceed max_bytes. With a ttl (seconds), entries
+    older than that are treated as missing and dropped on the next eviction.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, ttl=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.RLock()   # one connection shared by the threads of a process
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(*parts):
+        """Stable hash of the given inputs (strings or JSON-serializable values)."""
+        h = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, str) else json.dumps(part, sort_keys=True, ensure_ascii=False)
+            h.update(data.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def get_many(self, keys):
+        """{key: value} for the keys present in the cache."""
+        with self.lock:
+            keys = list(dict.fromkeys(keys))
+            found = {}
+            oldest = time.time() - self.ttl if self.ttl else 0
+            for start in range(0, len(keys), 500):   # stay under SQLite's variable limit
+                batch = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(batch))}) AND created >= ?",
+                    batch + [oldest]
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self.conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def put_many(self, items):
+        """Store {key: value} and evict old entries if the cache is over budget."""
+        with self.lock:
+            now = time.time()
+            rows = []
+            for key, value in items.items():
+                data = json.dumps(value, ensure_ascii=False)
+                rows.append((key, data, len(data.encode("utf-8")), now, now))
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+            self.evict()
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def total_bytes(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """Drop expired entries, then least-recently-used ones until the cache fits in max_bytes."""
+        with self.lock:
+            expired = 0
+            if self.ttl:
+                expired = self.conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,)).rowcount
+                self.conn.commit()
+
+            excess = self.total_bytes() - self.max_bytes
+            if excess <= 0:
+                return expired
+
+            victims = []
+            for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+            self.conn.commit()
+            return expired + len(victims)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self):
+        self.conn.close()
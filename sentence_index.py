@@ -0,0 +1,110 @@
+# sentence_index.py
+
+from collections import deque
+
+SENTENCE_SEPARATOR = "\x00"   # never part of a keyword, so no match spans two sentences
+
+
+class AhoCorasick:
+    """Multi-keyword substring matcher: one pass over the text finds every occurrence of every keyword."""
+
+    def __init__(self, keywords):
+        self.goto = [{}]        # state -> {char: state}
+        self.fail = [0]
+        self.output = [[]]      # state -> keywords ending here
+        for keyword in set(keywords):
+            if keyword:
+                self._add(keyword)
+        self._build_links()
+
+    def _add(self, keyword):
+        state = 0
+        for ch in keyword:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        self.output[state].append(keyword)
+
+    def _build_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def iter(self, text):
+        """Yield (end index, keyword) for every occurrence, overlapping ones included."""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for keyword in output[state]:
+                yield i, keyword
+
+
+class SentenceIndex:
+    """Keyword -> sentence IDs for one paper, built with a single Aho-Corasick pass.
+
+    A keyword belongs to a sentence when it occurs anywhere in it, as with
+    `keyword in sentence`; an empty keyword belongs to every sentence.
+    """
+
+    def __init__(self, sentences, keywords):
+        self.sentences = sentences
+        self.postings = {keyword: set() for keyword in keywords}
+        starts, text, offset = [], [], 0
+        for sentence in sentences:
+            starts.append(offset)
+            text.append(sentence)
+            offset += len(sentence) + len(SENTENCE_SEPARATOR)
+        joined = SENTENCE_SEPARATOR.join(text)
+
+        sentence_id = 0
+        for end, keyword in AhoCorasick(keywords).iter(joined):
+            while sentence_id + 1 < len(starts) and starts[sentence_id + 1] <= end:
+                sentence_id += 1
+            self.postings[keyword].add(sentence_id)
+        if "" in self.postings:
+            self.postings[""] = set(range(len(sentences)))
+
+    def sentence_ids(self, keyword):
+        return self.postings.get(keyword, set())
+
+    def contains(self, keyword):
+        return bool(self.sentence_ids(keyword))
+
+    def context(self, keywords, max_chars):
+        """Sentences mentioning the keywords, in document order, within max_chars.
+
+        Sentences mentioning all of them are taken first, then those mentioning any.
+        """
+        id_sets = [self.sentence_ids(keyword) for keyword in keywords]
+        if not id_sets:
+            return ""
+        both = set.intersection(*id_sets)
+        either = set.union(*id_sets) - both
+
+        candidates = sorted(both) + sorted(either)
+        if candidates and len(self.sentences[candidates[0]]) > max_chars:
+            return self.sentences[candidates[0]][:max_chars]   # a single sentence over the budget
+
+        chosen, used = [], 0
+        for sentence_id in candidates:
+            n = len(self.sentences[sentence_id]) + (1 if chosen else 0)
+            if used + n > max_chars:
+                continue
+            chosen.append(sentence_id)
+            used += n
+        return " ".join(self.sentences[i] for i in sorted(chosen))